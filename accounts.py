@@ -0,0 +1,104 @@
+import math
+import time
+import asyncio
+import metrics
+
+from collections import deque
+from typing import Optional, List
+
+from models import config
+
+class AccountState:
+    def __init__(self, account: config.Account, window: float):
+        self.account = account
+        self.window = window
+
+        self.busy = False
+        self.spent = 0
+        self.purchases: deque = deque()
+
+    @property
+    def name(self) -> str:
+        return str(self.account.user_name or self.account.user_id)
+
+    def remaining(self) -> Optional[int]:
+        if self.account.budget is None:
+            return None
+        return self.account.budget - self.spent
+
+    def can_afford(self, price: int) -> bool:
+        remaining = self.remaining()
+        return remaining is None or remaining >= price
+
+    def recent_purchases(self, now: float) -> int:
+        while self.purchases and self.purchases[0] < now - self.window:
+            self.purchases.popleft()
+        return len(self.purchases)
+
+    def rate_limited(self, now: float) -> bool:
+        limit = self.account.max_purchases_per_minute
+        return limit is not None and self.recent_purchases(now) >= limit * self.window / 60
+
+class AccountPool:
+    # routes each purchase to the idle account that can afford it and bought least recently, one buy in flight per account
+    def __init__(self, accounts: List[config.Account], window: float = 60, wait_timeout: float = 1):
+        self.states = [AccountState(account, window) for account in accounts]
+        self.wait_timeout = wait_timeout
+        self.released = asyncio.Event()
+
+        for state in self.states:
+            self.publish(state)
+
+    def update(self, accounts: List[config.Account]) -> None:
+        # accounts that stay keep what they spent and their purchase history
+        states = {id(state.account): state for state in self.states}
+        window = self.states[0].window if self.states else 60
+        self.states = [states.get(id(account)) or AccountState(account, window) for account in accounts]
+
+        for state in self.states:
+            self.publish(state)
+        self.released.set()
+
+    def publish(self, state: AccountState) -> None:
+        remaining = state.remaining()
+        if remaining is not None:
+            metrics.registry.set("account_budget_remaining", remaining, account = state.name)
+
+    def eligible(self, price: int) -> List[AccountState]:
+        now = time.monotonic()
+        return [state for state in self.states if state.can_afford(price) and not state.rate_limited(now)]
+
+    async def acquire(self, price: int) -> Optional[AccountState]:
+        deadline = time.monotonic() + self.wait_timeout
+        while True:
+            eligible = self.eligible(price)
+            if not eligible:
+                return None
+
+            idle = [state for state in eligible if not state.busy]
+            if idle:
+                now = time.monotonic()
+                # fewest recent purchases first, then the most budget left, no budget is unlimited
+                state = min(idle, key = lambda state: (state.recent_purchases(now), -(math.inf if state.remaining() is None else state.remaining())))
+
+                # reserve the price so parallel buys can not overspend the budget
+                state.busy = True
+                state.spent += price
+                return state
+
+            # every account that could take it is mid purchase, a buy takes a few hundred ms so wait a little
+            self.released.clear()
+            try:
+                await asyncio.wait_for(self.released.wait(), max(deadline - time.monotonic(), 0))
+            except asyncio.TimeoutError:
+                return None
+
+    def release(self, state: AccountState, price: int, bought: bool) -> None:
+        state.busy = False
+        if bought:
+            state.purchases.append(time.monotonic())
+        else:
+            state.spent -= price
+
+        self.publish(state)
+        self.released.set()
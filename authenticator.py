@@ -57,8 +57,9 @@ class AutoPass:
         meta_data = json.loads(base64.b64decode(challenge_data.rblx_challange_metadata).decode("utf-8"))
         
         response = request.Request(
-            url = f"https://twostepverification.roblox.com/v1/users/{previous_request.user_id}/challenges/authenticator/verify",
+            url = request.Routes.TWO_STEP_VERIFICATION.url(user_id = previous_request.user_id),
             method = "post",
+            route = request.Routes.TWO_STEP_VERIFICATION,
             headers = previous_request.headers,
             
             proxy = previous_request.proxy,
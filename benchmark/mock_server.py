@@ -0,0 +1,233 @@
+import json
+import time
+import random
+import logging
+import asyncio
+import threading
+
+from aiohttp import web
+from dataclasses import dataclass, field
+from typing import Optional, Dict, List, Tuple
+
+HOSTS = ("catalog.roblox.com", "apis.roblox.com", "auth.roblox.com", "users.roblox.com", "www.rolimons.com", "discord.com")
+
+@dataclass
+class MockSettings:
+    items: int = 2000
+    latency: float = 0.05
+    jitter: float = 0.02
+    error_rate: float = 0.0
+    rate_limit_rate: float = 0.0
+    # chance per polled item that its lowest price drops below the buy threshold
+    drop_rate: float = 0.001
+    # requests that come in on these ports fail with bad_error_rate, stands in for degraded proxies
+    bad_ports: Tuple[int, ...] = ()
+    bad_error_rate: float = 0.9
+    seed: Optional[int] = 1
+
+@dataclass
+class MockItem:
+    item_id: int
+    collectible_item_id: str
+    rap: int
+    value: int
+    price: int
+    dropped_at: Optional[float] = None
+
+@dataclass
+class MockStats:
+    requests: Dict[str, int] = field(default_factory = dict)
+    drops: int = 0
+    purchases: int = 0
+    drop_to_buy: List[float] = field(default_factory = list)
+
+class MockRoblox:
+    # local stand in for every endpoint the sniper talks to, served by one aiohttp app on its own thread
+    def __init__(self, settings: MockSettings):
+        self.settings = settings
+        self.random = random.Random(settings.seed)
+        self.stats = MockStats()
+
+        self.items: List[MockItem] = []
+        for index in range(settings.items):
+            rap = self.random.randint(100, 10000)
+            self.items.append(MockItem(
+                item_id = 1000 + index,
+                collectible_item_id = f"00000000-0000-0000-0000-{index:012d}",
+                rap = rap,
+                value = rap if self.random.random() < 0.5 else -1,
+                price = self.normal_price(rap)
+            ))
+        self.by_item_id = {item.item_id: item for item in self.items}
+        self.by_collectible_id = {item.collectible_item_id: item for item in self.items}
+
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.runner: Optional[web.AppRunner] = None
+        self.thread: Optional[threading.Thread] = None
+
+    def normal_price(self, rap: int) -> int:
+        return int(rap * self.random.uniform(1.05, 1.5))
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/v1/catalog/items/details", self.catalog_details)
+        app.router.add_post("/marketplace-items/v1/items/details", self.marketplace_details)
+        app.router.add_get("/marketplace-sales/v1/item/{collectible_item_id}/resellers", self.resellers)
+        app.router.add_post("/marketplace-sales/v1/item/{collectible_item_id}/purchase-resale", self.purchase_resale)
+        app.router.add_post("/v2/logout", self.logout)
+        app.router.add_get("/v1/users/authenticated", self.authenticated)
+        app.router.add_post("/v1/authentication-ticket", self.authentication_ticket)
+        app.router.add_post("/v1/authentication-ticket/redeem", self.redeem_authentication_ticket)
+        app.router.add_get("/catalog", self.rolimons_catalog)
+        app.router.add_post("/api/webhooks/{webhook_id}/{token}", self.webhook)
+        app.router.add_route("HEAD", "/", self.warm)
+        return app
+
+    async def simulate(self, name: str, request: Optional[web.Request] = None) -> Optional[web.Response]:
+        self.stats.requests[name] = self.stats.requests.get(name, 0) + 1
+        await asyncio.sleep(max(self.random.gauss(self.settings.latency, self.settings.jitter), 0))
+
+        roll = self.random.random()
+        # proxied requests carry the target url, the port they came in on says which "proxy" was used
+        if request is not None and request.transport and request.transport.get_extra_info("sockname")[1] in self.settings.bad_ports and roll < self.settings.bad_error_rate:
+            return web.json_response({"errors": [{"code": 0, "message": "BadGateway"}]}, status = 502)
+        if roll < self.settings.rate_limit_rate:
+            return web.json_response({"errors": [{"code": 0, "message": "TooManyRequests"}]}, status = 429)
+        if roll < self.settings.rate_limit_rate + self.settings.error_rate:
+            return web.json_response({"errors": [{"code": 0, "message": "InternalServerError"}]}, status = 500)
+        return None
+
+    def poll_item(self, item: MockItem) -> MockItem:
+        if item.dropped_at is None and self.random.random() < self.settings.drop_rate:
+            item.price = max(int(item.rap * 0.5), 1)
+            item.dropped_at = time.perf_counter()
+            self.stats.drops += 1
+        return item
+
+    async def catalog_details(self, request: web.Request) -> web.Response:
+        failed = await self.simulate("catalog_details", request)
+        if failed:
+            return failed
+
+        payload = await request.json()
+        data = []
+        for entry in payload["items"]:
+            item = self.by_item_id.get(entry["id"])
+            if item:
+                self.poll_item(item)
+                data.append({
+                    "id": item.item_id, "itemType": "Asset", "name": f"Item {item.item_id}", "description": "",
+                    "productId": item.item_id * 10, "collectibleItemId": item.collectible_item_id,
+                    "lowestResalePrice": item.price, "price": None, "favoriteCount": 0
+                })
+        return web.json_response({"data": data})
+
+    async def marketplace_details(self, request: web.Request) -> web.Response:
+        failed = await self.simulate("marketplace_details", request)
+        if failed:
+            return failed
+
+        payload = await request.json()
+        data = []
+        for collectible_item_id in payload["itemIds"]:
+            item = self.by_collectible_id.get(collectible_item_id)
+            if item:
+                self.poll_item(item)
+                data.append({
+                    "collectibleItemId": item.collectible_item_id, "name": f"Item {item.item_id}", "description": "",
+                    "itemTargetId": item.item_id, "productTargetId": item.item_id * 10,
+                    "lowestResalePrice": item.price, "totalQuantity": 100, "hasResellers": True
+                })
+        return web.json_response(data)
+
+    async def resellers(self, request: web.Request) -> web.Response:
+        failed = await self.simulate("resellers")
+        if failed:
+            return failed
+
+        item = self.by_collectible_id[request.match_info["collectible_item_id"]]
+        return web.json_response({"data": [{
+            "collectibleItemInstanceId": f"instance-{item.item_id}-{item.price}",
+            "collectibleProductId": f"product-{item.item_id}",
+            "seller": {"sellerId": 1, "sellerType": "User"},
+            "price": item.price
+        }]})
+
+    async def purchase_resale(self, request: web.Request) -> web.Response:
+        failed = await self.simulate("purchase_resale")
+        if failed:
+            return failed
+
+        item = self.by_collectible_id[request.match_info["collectible_item_id"]]
+        payload = await request.json()
+        purchased = item.dropped_at is not None and payload["expectedPrice"] == item.price
+        if purchased:
+            self.stats.purchases += 1
+            self.stats.drop_to_buy.append(time.perf_counter() - item.dropped_at)
+            item.price = self.normal_price(item.rap)
+            item.dropped_at = None
+
+        return web.json_response({
+            "purchaseResult": "Purchase transaction success." if purchased else "Price mismatch",
+            "purchased": purchased, "pending": False, "errorMessage": None if purchased else "PriceMismatch"
+        })
+
+    async def logout(self, request: web.Request) -> web.Response:
+        self.stats.requests["logout"] = self.stats.requests.get("logout", 0) + 1
+        return web.Response(status = 403, headers = {"x-csrf-token": f"token-{int(time.time())}"})
+
+    async def authenticated(self, request: web.Request) -> web.Response:
+        return web.json_response({"id": 1, "name": "benchmark", "displayName": "benchmark"})
+
+    async def authentication_ticket(self, request: web.Request) -> web.Response:
+        return web.Response(headers = {"rbx-authentication-ticket": "ticket"})
+
+    async def redeem_authentication_ticket(self, request: web.Request) -> web.Response:
+        response = web.Response()
+        response.set_cookie(".ROBLOSECURITY", "benchmark-cookie")
+        return response
+
+    async def rolimons_catalog(self, request: web.Request) -> web.Response:
+        self.stats.requests["rolimons"] = self.stats.requests.get("rolimons", 0) + 1
+
+        item_details = {}
+        for item in self.items:
+            details = [f"Item {item.item_id}"] + [0] * 19
+            details[8] = item.rap
+            details[16] = item.value
+            item_details[str(item.item_id)] = details
+        html = f"<html><head><script>var item_details = {json.dumps(item_details)};\nvar other = 1;</script></head></html>"
+        return web.Response(text = html, content_type = "text/html")
+
+    async def webhook(self, request: web.Request) -> web.Response:
+        return web.Response(status = 204)
+
+    async def warm(self, request: web.Request) -> web.Response:
+        return web.Response(status = 404)
+
+    def start(self, ports: List[int]) -> None:
+        # own loop on its own thread so the server does not share a core with the sniper loop being measured
+        ready = threading.Event()
+        # requests still in flight when the benchmark cancels the sniper show up as connection lost tracebacks
+        logging.getLogger("aiohttp.server").setLevel(logging.CRITICAL)
+
+        async def serve():
+            self.runner = web.AppRunner(self.app(), access_log = None)
+            await self.runner.setup()
+            for port in ports:
+                await web.TCPSite(self.runner, "127.0.0.1", port).start()
+            ready.set()
+
+        def run():
+            self.loop = asyncio.new_event_loop()
+            self.loop.run_until_complete(serve())
+            self.loop.run_forever()
+
+        self.thread = threading.Thread(target = run, daemon = True)
+        self.thread.start()
+        ready.wait()
+
+    def stop(self) -> None:
+        asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
@@ -0,0 +1,183 @@
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+
+import shards
+import helpers
+import sniper
+import authenticator
+
+from typing import List, Dict, Optional, Union
+from models import config, items, request
+from benchmark.mock_server import MockRoblox, MockSettings, HOSTS
+
+# higher is better for these, lower is better for everything else that gets compared
+HIGHER_IS_BETTER = ("items_per_sec", "requests_per_sec")
+COMPARED = ("items_per_sec", "requests_per_sec", "cpu_ms_per_request", "detect_to_buy_ms.p90")
+
+def free_ports(count: int) -> List[int]:
+    sockets = [socket.socket() for _ in range(count)]
+    for sock in sockets:
+        sock.bind(("127.0.0.1", 0))
+    ports = [sock.getsockname()[1] for sock in sockets]
+    for sock in sockets:
+        sock.close()
+    return ports
+
+def percentiles(samples: List[float]) -> Dict[str, Optional[float]]:
+    if not samples:
+        return {"p50": None, "p90": None, "p99": None}
+
+    ordered = sorted(samples)
+    pick = lambda fraction: round(ordered[min(int(len(ordered) * fraction), len(ordered) - 1)] * 1000, 2)
+    return {"p50": pick(0.5), "p90": pick(0.9), "p99": pick(0.99)}
+
+def build_settings(mock: MockRoblox, proxies: List[str], scheduler: config.SchedulerSettings, workers: int = 1, store_path: Optional[str] = None, discover: bool = False) -> config.Settings:
+    account = config.Account(cookie = "benchmark-cookie", otp_token = authenticator.AutoPass(""))
+
+    return config.Settings(
+        webhook = "https://discord.com/api/webhooks/1/benchmark",
+        account = account,
+        buy_settings = config.BuySettings(
+            generic_settings = config.ItemSettings(min_percentage_off = 15, price_measurer = "rap"),
+            custom_settings = {}
+        ),
+        # discovery starts from nothing and finds the items through the mock rolimons page
+        limiteds = helpers.Iterator(
+            data = [] if discover else [items.Generic(item_id = item.item_id, collectible_item_id = item.collectible_item_id) for item in mock.items],
+            settings = config.PrioritySettings()
+        ),
+        proxies = proxies,
+        scheduler = scheduler,
+        shards = config.ShardSettings(workers = workers),
+        store = config.StoreSettings(path = store_path),
+        discovery = config.DiscoverySettings(enabled = discover, cache_path = None, batch_interval = 0)
+    )
+
+async def drive(runner: Union[sniper.WatchLimiteds, shards.Coordinator], watch_limiteds: sniper.WatchLimiteds, duration: float, warmup: float) -> dict:
+    # cpu time is only the main loop, with workers that is the coordinator
+    task = asyncio.ensure_future(runner())
+
+    await asyncio.sleep(warmup)
+    ui_manager = watch_limiteds.ui_manager
+    requests_before, items_before = ui_manager.total_requests, ui_manager.total_items_checked
+    latencies_before = len(watch_limiteds.buy_limited.latencies)
+    cpu_before, started = time.thread_time(), time.perf_counter()
+
+    await asyncio.sleep(duration)
+
+    cpu, elapsed = time.thread_time() - cpu_before, time.perf_counter() - started
+    requests_made = ui_manager.total_requests - requests_before
+    items_checked = ui_manager.total_items_checked - items_before
+    latencies = list(watch_limiteds.buy_limited.latencies)[latencies_before:]
+
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+
+    return {
+        "items_per_sec": round(items_checked / elapsed, 2),
+        "requests_per_sec": round(requests_made / elapsed, 2),
+        "cpu_ms_per_request": round(cpu * 1000 / max(requests_made, 1), 3),
+        "detect_to_buy_ms": percentiles(latencies)
+    }
+
+def lookup(report: dict, path: str) -> Optional[float]:
+    for key in path.split("."):
+        report = report.get(key) if isinstance(report, dict) else None
+    return report
+
+def compare(report: dict, baseline: dict, tolerance: float) -> List[str]:
+    regressions = []
+    for metric in COMPARED:
+        current, previous = lookup(report, metric), lookup(baseline, metric)
+        if current is None or not previous:
+            continue
+
+        change = (current - previous) / previous
+        if metric in HIGHER_IS_BETTER:
+            change = -change
+        if change > tolerance:
+            regressions.append(f"{metric}: {previous} -> {current} ({change:+.0%} worse)")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description = "Offline sniper benchmark against a local mock of roblox / rolimons")
+    parser.add_argument("--duration", type = float, default = 20)
+    parser.add_argument("--warmup", type = float, default = 3)
+    parser.add_argument("--items", type = int, default = 2000)
+    parser.add_argument("--proxies", type = int, default = 4)
+    parser.add_argument("--latency", type = float, default = 0.05)
+    parser.add_argument("--jitter", type = float, default = 0.02)
+    parser.add_argument("--error-rate", type = float, default = 0.0)
+    parser.add_argument("--rate-limit-rate", type = float, default = 0.0)
+    parser.add_argument("--drop-rate", type = float, default = 0.001)
+    parser.add_argument("--bad-proxies", type = int, default = 0, help = "this many proxies fail most of their requests")
+    parser.add_argument("--max-rate", type = float, default = 5.0)
+    parser.add_argument("--store", help = "write observations to this sqlite file, off by default")
+    parser.add_argument("--discover", action = "store_true", help = "build the watched items with rolimons discovery instead of listing them")
+    parser.add_argument("--workers", type = int, default = 1, help = "shard worker processes, proxies are split between them")
+    parser.add_argument("--baseline", help = "compare against this baseline json, exit 1 on regression")
+    parser.add_argument("--save-baseline", help = "write the report to this path")
+    parser.add_argument("--tolerance", type = float, default = 0.1)
+    args = parser.parse_args()
+
+    mock = MockRoblox(MockSettings(
+        items = args.items,
+        latency = args.latency,
+        jitter = args.jitter,
+        error_rate = args.error_rate,
+        rate_limit_rate = args.rate_limit_rate,
+        drop_rate = args.drop_rate
+    ))
+    server_port, *proxy_ports = free_ports(args.proxies + 1)
+    mock.settings.bad_ports = tuple(proxy_ports[:args.bad_proxies])
+    mock.start([server_port] + proxy_ports)
+
+    request.session_pool.overrides = {host: f"http://127.0.0.1:{server_port}" for host in HOSTS}
+    try:
+        settings = build_settings(
+            mock,
+            proxies = [f"http://127.0.0.1:{port}" for port in proxy_ports],
+            scheduler = config.SchedulerSettings(max_rate = args.max_rate),
+            workers = args.workers,
+            store_path = args.store,
+            discover = args.discover
+        )
+        rolimon_limiteds = helpers.RolimonsDataScraper(cache_path = None)
+        if args.workers > 1:
+            runner = shards.Coordinator(settings, rolimon_limiteds, ui = False)
+            watch_limiteds = runner.watch_limiteds
+        else:
+            runner = watch_limiteds = sniper.WatchLimiteds(settings, rolimon_limiteds, ui = False)
+        report = asyncio.run(drive(runner, watch_limiteds, args.duration, args.warmup))
+    finally:
+        mock.stop()
+
+    report["drop_to_buy_ms"] = percentiles(mock.stats.drop_to_buy)
+    report["drops"] = mock.stats.drops
+    report["purchases"] = mock.stats.purchases
+    report["server_requests"] = mock.stats.requests
+    report["parameters"] = vars(args)
+
+    print(json.dumps(report, indent = 4))
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as file:
+            json.dump(report, file, indent = 4)
+
+    if args.baseline:
+        with open(args.baseline, "r") as file:
+            regressions = compare(report, json.load(file), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
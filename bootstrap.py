@@ -0,0 +1,84 @@
+import time
+import errors
+import asyncio
+import helpers
+import metrics
+
+from urllib.parse import urlsplit
+from typing import Optional, Dict, List, Tuple, Awaitable
+
+from models import config, request
+
+def origin(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}/"
+
+class Bootstrap:
+    # launch to first poll on the loop the sniper then runs on, logins, rolimons and connection warmup overlap
+    def __init__(self, path: str = "config.json", warm_timeout: float = 5):
+        self.path = path
+        self.warm_timeout = warm_timeout
+        self.timings: Dict[str, float] = {}
+
+    async def timed(self, step: str, awaitable: Awaitable):
+        started = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            self.timings[step] = time.perf_counter() - started
+            metrics.registry.set("startup_seconds", round(self.timings[step], 3), step = step)
+
+    def load_config(self) -> config.Settings:
+        return config.parse(config.read(self.path), login = False)
+
+    async def load_rolimons(self) -> helpers.RolimonsDataScraper:
+        # the disk snapshot is enough to start, only without one the first poll waits for the download
+        rolimon_limiteds = await self.timed("rolimons cache", asyncio.get_running_loop().run_in_executor(None, helpers.RolimonsDataScraper))
+        if not rolimon_limiteds.snapshot:
+            await self.timed("rolimons download", rolimon_limiteds.refresh())
+        return rolimon_limiteds
+
+    async def touch(self, url: str, proxy: Optional[str]) -> None:
+        try:
+            await request.Request(
+                url = url,
+                method = "head",
+                success_status_codes = [200, 301, 302, 403, 404, 405],
+                proxy = proxy,
+                timeout = self.warm_timeout
+            ).send()
+        except errors.Request.Failed:
+            pass
+
+    async def warm(self, proxies: List[str]) -> None:
+        # dns, tcp and tls are paid here instead of by the first poll on every proxy, the pooled sessions keep the connections
+        polled = {origin(request.Routes.CATALOG_DETAILS.template), origin(request.Routes.MARKETPLACE_DETAILS.template)}
+        await asyncio.gather(
+            # purchases always go out directly
+            self.touch(origin(request.Routes.PURCHASE_RESALE.template), None),
+            *[self.touch(url, proxy) for url in polled for proxy in set(proxies)]
+        )
+
+    async def __call__(self) -> Tuple[config.Settings, helpers.RolimonsDataScraper]:
+        started = time.perf_counter()
+        rolimons = asyncio.ensure_future(self.load_rolimons())
+        try:
+            settings = await self.timed("config", asyncio.get_running_loop().run_in_executor(None, self.load_config))
+
+            _, _, rolimon_limiteds = await asyncio.gather(
+                asyncio.gather(*[self.timed(f"login {account_index}", account.authenticate()) for account_index, account in enumerate(settings.accounts)]),
+                self.timed("warmup", self.warm(settings.proxies)),
+                rolimons
+            )
+        except BaseException:
+            rolimons.cancel()
+            await request.session_pool.close()
+            raise
+
+        self.timings["total"] = time.perf_counter() - started
+        metrics.registry.set("startup_seconds", round(self.timings["total"], 3), step = "total")
+        return settings, rolimon_limiteds
+
+    def summary(self) -> str:
+        steps = " | ".join(f"{step} {seconds:.2f}s" for step, seconds in self.timings.items() if step != "total")
+        return f"Started in {self.timings.get('total', 0):.2f}s | {steps}"
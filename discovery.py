@@ -0,0 +1,149 @@
+import os
+import json
+import time
+import errors
+import asyncio
+import metrics
+
+from typing import Optional, List, Dict, Callable
+
+from models import config, items, request
+
+class Discovery:
+    # builds the watched limiteds from the rolimons snapshot, collectible item ids come from a disk cache or batched catalog lookups
+    def __init__(self, settings: config.DiscoverySettings, unresolved: List[int], watch_limiteds: 'sniper.WatchLimiteds'):
+        self.settings = settings
+        self.unresolved = unresolved
+        self.watch_limiteds = watch_limiteds
+
+        # "" is an item without a collectible item id, cached too so it is not looked up on every start
+        self.collectible_ids: Dict[int, str] = {}
+        self.tracked: Dict[int, items.Generic] = {}
+        # shard mode hands new items to the workers instead
+        self.feed: Callable[[List[items.Generic]], int] = watch_limiteds.limiteds.add
+
+    @property
+    def active(self) -> bool:
+        return self.settings.enabled or bool(self.unresolved)
+
+    def select(self, snapshot: items.RolimonsTable) -> List[int]:
+        settings = self.settings
+        if not settings.enabled:
+            return list(self.unresolved)
+
+        def within(number: int, low: Optional[int], high: Optional[int], lowest: int) -> bool:
+            if low is None and high is None:
+                return True
+            # rolimons has -1 for no value / rap / demand, an unrated item never passes a bound on that field
+            return number >= lowest and (low is None or number >= low) and (high is None or number <= high)
+
+        selected = [
+            (value, item_id) for item_id, rap, value, demand in snapshot.rows_with_demand()
+            # demand 0 is a real rating (terrible), a value or rap of 0 is not
+            if within(value, settings.min_value, settings.max_value, 1) and within(rap, settings.min_rap, settings.max_rap, 1) and within(demand, settings.min_demand, None, 0)
+        ]
+        selected.sort(reverse = True)
+        if settings.max_items is not None:
+            selected = selected[:settings.max_items]
+
+        # limiteds listed in the config come first and are never filtered out
+        return list(dict.fromkeys(self.unresolved + [item_id for _, item_id in selected]))
+
+    def publish(self, item_ids: List[int]) -> int:
+        new = [
+            items.Generic(item_id = item_id, collectible_item_id = self.collectible_ids[item_id])
+            for item_id in item_ids
+            if self.collectible_ids.get(item_id) and item_id not in self.tracked
+        ]
+        for item in new:
+            self.tracked[item.item_id] = item
+
+        metrics.registry.set("discovered_limiteds", len(self.tracked))
+        return self.feed(new) if new else 0
+
+    async def lookup(self, item_ids: List[int]) -> request.ResponseJsons.ItemDetails:
+        account = self.watch_limiteds.account
+        response = await request.Request(
+            url = request.Routes.CATALOG_DETAILS.template,
+            method = "post",
+            route = request.Routes.CATALOG_DETAILS,
+            headers = request.Headers(
+                cookies = {".ROBLOSECURITY": account.cookie},
+                x_csrf_token = await account.x_csrf_token()
+            ),
+            x_csrf_token = account.x_csrf_token,
+            json_data = request.Routes.CATALOG_DETAILS.encode([items.Generic(item_id = item_id, collectible_item_id = None) for item_id in item_ids]),
+            timeout = self.watch_limiteds.scheduler_settings.timeout
+        ).send()
+        return response.response_json
+
+    async def resolve(self, item_ids: List[int]) -> bool:
+        looked_up = 0
+        try:
+            for start in range(0, len(item_ids), self.settings.batch_size):
+                batch = item_ids[start:start + self.settings.batch_size]
+                try:
+                    with metrics.registry.timer("stage_seconds", stage = "discovery_lookup"):
+                        details = await self.lookup(batch)
+                except errors.Request.Failed as reason:
+                    metrics.registry.increment("discovery_lookups_total", result = "failed")
+                    self.watch_limiteds.ui_manager.log_event(f"Discovery lookup failed, retrying later: {reason!r}")
+                    return False
+
+                metrics.registry.increment("discovery_lookups_total", result = "ok")
+                found = {int(item.item_id): item.collectible_item_id or "" for item in details.items}
+                for item_id in batch:
+                    self.collectible_ids[item_id] = found.get(item_id, "")
+                looked_up += len(batch)
+
+                # watched as soon as its batch is back, no waiting for the whole universe
+                self.publish(batch)
+                await asyncio.sleep(self.settings.batch_interval)
+            return True
+        finally:
+            # written once per pass, also when it failed or was cancelled halfway so the lookups are not paid again
+            if looked_up and self.settings.cache_path:
+                await asyncio.get_running_loop().run_in_executor(None, self.save_cache, dict(self.collectible_ids))
+
+    def load_cache(self) -> Dict[int, str]:
+        if not self.settings.cache_path or not os.path.exists(self.settings.cache_path):
+            return {}
+
+        try:
+            with open(self.settings.cache_path, "r") as file:
+                cached = json.load(file)
+            return {int(item_id): collectible_item_id or "" for item_id, collectible_item_id in cached["items"].items()}
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            return {}
+
+    def save_cache(self, collectible_ids: Dict[int, str]) -> None:
+        temp_path = f"{self.settings.cache_path}.tmp"
+        with open(temp_path, "w") as file:
+            json.dump({"items": collectible_ids}, file)
+        os.replace(temp_path, self.settings.cache_path)
+
+    async def run(self):
+        if not self.active:
+            return
+
+        self.collectible_ids = await asyncio.get_running_loop().run_in_executor(None, self.load_cache)
+        rolimon_limiteds = self.watch_limiteds.rolimon_limiteds
+        snapshot, resolved, attempted = None, True, 0.0
+
+        while True:
+            # a new snapshot is picked up right away, failed lookups are retried every retry_interval
+            if rolimon_limiteds.snapshot is not snapshot or (not resolved and time.monotonic() - attempted >= self.settings.retry_interval):
+                snapshot, attempted = rolimon_limiteds.snapshot, time.monotonic()
+                item_ids = self.select(snapshot)
+
+                # everything in the cache is watched right away, only the rest waits for lookups
+                tracked = len(self.tracked)
+                self.publish(item_ids)
+                missing = [item_id for item_id in item_ids if item_id not in self.collectible_ids]
+                if missing:
+                    resolved = await self.resolve(missing)
+
+                if len(self.tracked) != tracked:
+                    self.watch_limiteds.ui_manager.log_event(f"Discovery watching {len(self.tracked)} limiteds | +{len(self.tracked) - tracked} | {len(missing)} looked up")
+
+            await asyncio.sleep(0.5)
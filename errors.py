@@ -7,7 +7,11 @@ class InvalidChallangeType(Exception): pass
 class Request:
     class Failed(Exception): pass
     
-    class InvalidStatus(Exception): pass
+    class InvalidStatus(Exception):
+        def __init__(self, status: int, headers: dict = None):
+            super().__init__(status)
+            self.status = status
+            self.headers = headers or {}
 
 class Config:
     class InvalidFormat(Exception): pass
@@ -1,67 +1,105 @@
-import re
+import os
+import math
 import time
 import time
 import json
+import heapq
 import errors
 import random
 import asyncio
 import aiohttp
+import metrics
 
-from models import request, items
-from typing import Optional, Union, List, Dict, TYPE_CHECKING
-
-from rich.console import Console
-from rich.live import Live
-from rich.table import Table
-from rich.panel import Panel
-from rich.text import Text
-from rich.align import Align
-from rich.layout import Layout
-from rich.box import HEAVY
+from models import request, items, rolimons
+from collections import deque
+from typing import Optional, Union, List, Dict, Mapping, Tuple, Hashable, Callable, Awaitable, Any, TYPE_CHECKING
 
 if TYPE_CHECKING:
     from sniper import WatchLimiteds
+    from scheduler import RequestScheduler, ProxyPool
+    from models.config import PrioritySettings, UISettings
 
 class UIManager:
-    def __init__(self, total_proxies: int):
+    # everything runs on the one event loop thread, so the counters need no lock
+    def __init__(self, total_proxies: int, scheduler: Optional["RequestScheduler"] = None, headless: bool = False, max_logs: int = 20, proxy_pool: Optional["ProxyPool"] = None):
         self.start_time = time.time()
         self.total_proxies = total_proxies
+        self.scheduler = scheduler
+        self.proxy_pool = proxy_pool
+        self.headless = headless
         self.total_requests = 0
         self.total_items_checked = 0
         self.total_items_bought = 0
-        self.lock = asyncio.Lock()
-        self.logs = []
-
-    async def log_event(self, message: str):
-        async with self.lock:
-            timestamp = time.strftime('%H:%M:%S')
-            self.logs.append(f"[{timestamp}] {message}")
-            if len(self.logs) > 20:
-                self.logs.pop(0)
+        self.logs = deque(maxlen = max_logs)
 
-    async def add_requests(self, count: int):
-        async with self.lock:
-            self.total_requests += count
+    def log_event(self, message: str):
+        timestamp = time.strftime('%H:%M:%S')
+        self.logs.append(f"[{timestamp}] {message}")
+        if self.headless:
+            print(self.logs[-1], flush = True)
 
-    async def add_items(self, count: int):
-        async with self.lock:
-            self.total_items_checked += count
+    def add_requests(self, count: int):
+        self.total_requests += count
 
-    async def add_items_bought(self, count: int = 1):
-        async with self.lock:
-            self.total_items_bought += count
+    def add_items(self, count: int):
+        self.total_items_checked += count
 
-    def render(self):
+    def add_items_bought(self, count: int = 1):
+        self.total_items_bought += count
+    
+    def uptime(self) -> str:
         elapsed = int(time.time() - self.start_time)
         mins, secs = divmod(elapsed, 60)
-        uptime = f"{mins}m {secs}s"
+        return f"{mins}m {secs}s"
+    
+    def request_rate(self) -> Optional[str]:
+        if not self.scheduler:
+            return None
+        
+        rates = self.scheduler.rates()
+        total_rate = sum(rates.values())
+        return f"{total_rate:.1f}/s ({total_rate / max(len(rates), 1):.2f}/s per proxy)"
+    
+    def batch_sizes(self) -> Optional[str]:
+        if not self.scheduler:
+            return None
+        
+        sizes = self.scheduler.batch_sizes()
+        return ", ".join(f"{endpoint} {size:.0f}" for endpoint, size in sorted(sizes.items())) or None
+    
+    def summary(self) -> str:
+        request_rate = self.request_rate()
+        batch_sizes = self.batch_sizes()
+        return " | ".join(filter(None, [
+            f"Proxies {self.proxy_pool.summary() if self.proxy_pool else self.total_proxies}",
+            f"Requests {self.total_requests}",
+            f"Rate {request_rate}" if request_rate else None,
+            f"Batch {batch_sizes}" if batch_sizes else None,
+            f"Checked {self.total_items_checked}",
+            f"Bought {self.total_items_bought}",
+            f"Uptime {self.uptime()}"
+        ]))
+
+    def render(self):
+        # rich only gets imported when there is a tui to draw
+        from rich.table import Table
+        from rich.panel import Panel
+        from rich.layout import Layout
+        
+        uptime = self.uptime()
 
         stats = Table.grid(padding=1)
         stats.add_column(justify="right", style="bold cyan")
         stats.add_column(style="bold white")
 
-        stats.add_row("Proxies", str(self.total_proxies))
+        stats.add_row("Proxies", self.proxy_pool.summary() if self.proxy_pool else str(self.total_proxies))
         stats.add_row("Total Requests", str(self.total_requests))
+        request_rate = self.request_rate()
+        if request_rate:
+            stats.add_row("Request Rate", request_rate)
+        batch_sizes = self.batch_sizes()
+        if batch_sizes:
+            stats.add_row("Batch Sizes", batch_sizes)
         stats.add_row("Items Checked", str(self.total_items_checked))
         stats.add_row("Items Bought", str(self.total_items_bought))
         stats.add_row("Uptime", uptime)
@@ -75,18 +113,30 @@ class UIManager:
 
         layout = Layout()
         layout.split(
-            Layout(Panel(stats, title="Global Stats", border_style="green", padding=(1, 2)), name="upper", size=14),
+            Layout(Panel(stats, title="Global Stats", border_style="green", padding=(1, 2)), name="upper", size=2 * stats.row_count + 4),
             Layout(log_panel, name="lower")
         )
 
         return layout
 
-async def run_ui(ui_manager: UIManager):
+async def run_ui(ui_manager: UIManager, settings: Optional["UISettings"] = None):
+    refresh_per_second = settings.refresh_per_second if settings else 2
+    
+    if ui_manager.headless:
+        # events are printed as they happen, only a summary line on an interval
+        while True:
+            await asyncio.sleep(settings.summary_interval if settings else 60)
+            print(f"[{time.strftime('%H:%M:%S')}] {ui_manager.summary()}", flush = True)
+    
+    from rich.console import Console
+    from rich.live import Live
+    
     console = Console()
-    with Live(ui_manager.render(), refresh_per_second=2, console=console) as live:
+    # auto refresh off, rich would otherwise render again on its own thread on top of our updates
+    with Live(ui_manager.render(), auto_refresh=False, console=console) as live:
         while True:
-            await asyncio.sleep(0.5)
-            live.update(ui_manager.render())
+            await asyncio.sleep(1 / refresh_per_second)
+            live.update(ui_manager.render(), refresh=True)
                 
 class CombinedAttribute:
     def __init__(self, watch_limiteds: 'WatchLimiteds'):
@@ -107,55 +157,213 @@ class CombinedAttribute:
         else:
             delattr(self.watch_limiteds, name)
 
+class ItemSignals:
+    __slots__ = ("value", "last_price", "volatility", "proximity")
+    
+    def __init__(self):
+        self.value = 0
+        self.last_price = None
+        self.volatility = 0.0
+        self.proximity = 0.0
+
 class Iterator:
-    def __init__(self, data: List[items.Generic]):
+    # stride scheduling, every item is due again 1 / weight virtual ticks after it was handed out
+    # weights are capped at max_boost so the least interesting item still gets 1 / max_boost of a fair share
+    def __init__(self, data: List[items.Generic], settings: Optional["PrioritySettings"] = None):
         self.original_data = data[:]
+        self.settings = settings
+        self.signals: Dict[int, ItemSignals] = {}
         self._reset_pool()
 
     def _reset_pool(self, ):
-        self.pool = self.original_data[:]
-        random.shuffle(self.pool)
-        self.index = 0
-
+        self.clock = 0.0
+        self.sequence = 0
+        self.pool = []
+        for item in self.original_data:
+            self._push(item, random.random() * self.period(item.item_id))
+        heapq.heapify(self.pool)
+
+    def _push(self, item: items.Generic, due: float) -> None:
+        self.sequence += 1
+        self.pool.append((due, self.sequence, item))
+
+    def weight(self, item_id: int) -> float:
+        signals = self.signals.get(item_id)
+        if not self.settings or not signals:
+            return 1.0
+        
+        weight = 1.0
+        # 100k value maxes out the value signal
+        weight += self.settings.value_weight * min(math.log10(1 + max(signals.value, 0)) / 5, 1)
+        weight += self.settings.volatility_weight * min(signals.volatility * 10, 1)
+        weight += self.settings.proximity_weight * signals.proximity
+        return min(weight, self.settings.max_boost)
+
+    def period(self, item_id: int) -> float:
+        return 1 / self.weight(item_id)
+
+    def observe(self, item_id: int, price: Optional[int], max_price: int, value: int = 0) -> None:
+        signals = self.signals.get(item_id)
+        if signals is None:
+            signals = self.signals[item_id] = ItemSignals()
+        
+        signals.value = value
+        if price:
+            if signals.last_price:
+                change = abs(price - signals.last_price) / signals.last_price
+                signals.volatility += (change - signals.volatility) * 0.2
+            signals.last_price = price
+            # 1 when the item is buyable, falls off the further the price is above the threshold
+            signals.proximity = min(max(max_price, 0) / price, 1)
+
+    def add(self, data: List[items.Generic]) -> int:
+        # joins the running schedule, items already watched are skipped
+        current = {(item.item_id, item.collectible_item_id) for item in self.original_data}
+        added = 0
+        for item in data:
+            key = (item.item_id, item.collectible_item_id)
+            if key in current:
+                continue
+            
+            current.add(key)
+            self.original_data.append(item)
+            # spread over one period like the initial fill, so a batch of new items does not all come due at once
+            self.sequence += 1
+            heapq.heappush(self.pool, (self.clock + random.random() * self.period(item.item_id), self.sequence, item))
+            added += 1
+        
+        return added
+    
+    def update(self, data: List[items.Generic]) -> Tuple[int, int]:
+        # new list from a config reload, kept items keep their place in the schedule and their signals
+        incoming = {(item.item_id, item.collectible_item_id) for item in data}
+        retired = {(item.item_id, item.collectible_item_id) for item in self.original_data} - incoming
+        
+        if retired:
+            self.original_data = [item for item in self.original_data if (item.item_id, item.collectible_item_id) not in retired]
+            self.pool = [entry for entry in self.pool if (entry[2].item_id, entry[2].collectible_item_id) not in retired]
+            heapq.heapify(self.pool)
+            for item_id, _ in retired:
+                self.signals.pop(item_id, None)
+        
+        return self.add(data), len(retired)
+    
+    def restore(self, item_id: int, last_price: Optional[int], volatility: float) -> None:
+        signals = self.signals.get(item_id)
+        if signals is None:
+            signals = self.signals[item_id] = ItemSignals()
+        
+        signals.last_price = last_price or None
+        signals.volatility = volatility or 0.0
+    
     def __call__(self, batch_size: int) -> List[items.Generic]:
         if batch_size >= len(self.original_data):
             return self.original_data[:]
         
         batch = []
         
-        while len(batch) < batch_size:
-            if self.index >= len(self.pool):
-                self._reset_pool()
-
-            needed = batch_size - len(batch)
-            available = len(self.pool) - self.index
-            take = min(needed, available)
-
-            batch.extend(self.pool[self.index:self.index + take])
-            self.index += take
+        for _ in range(batch_size):
+            due, _, item = heapq.heappop(self.pool)
+            self.clock = due
+            batch.append(item)
+        
+        for item in batch:
+            self.sequence += 1
+            heapq.heappush(self.pool, (self.clock + self.period(item.item_id), self.sequence, item))
 
         return batch
 
+class SingleFlight:
+    # concurrent callers with the same key join one running call instead of starting their own
+    def __init__(self, cooldown: float = 0):
+        self.cooldown = cooldown
+        self.in_flight: Dict[Hashable, asyncio.Future] = {}
+        self.cooldowns: Dict[Hashable, float] = {}
+    
+    def cooling_down(self, key: Hashable) -> bool:
+        until = self.cooldowns.get(key)
+        if until is None:
+            return False
+        if until > time.monotonic():
+            return True
+        
+        del self.cooldowns[key]
+        return False
+    
+    def _finish(self, key: Hashable) -> None:
+        self.in_flight.pop(key, None)
+        if self.cooldown:
+            now = time.monotonic()
+            self.cooldowns[key] = now + self.cooldown
+            if len(self.cooldowns) > 1000:
+                self.cooldowns = {key: until for key, until in self.cooldowns.items() if until > now}
+    
+    async def __call__(self, key: Hashable, call: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        # returns (result, leader), only the leader should act on the result (logging, webhooks ...)
+        future = self.in_flight.get(key)
+        if future is not None:
+            return await asyncio.shield(future), False
+        
+        future = self.in_flight[key] = asyncio.ensure_future(call())
+        future.add_done_callback(lambda _: self._finish(key))
+        return await asyncio.shield(future), True
+
 class XCsrfTokenWaiter:
-    def __init__(self, cookie: Optional[str] = None, proxy: Optional[str] = None, on_start: bool = False):
-        self.last_call_time = time.time()
+    # the token is refreshed by run() in the background before it expires, callers only ever read the cached one
+    def __init__(self, cookie: Optional[str] = None, proxy: Optional[str] = None, lifetime: float = 120, refresh_margin: float = 20, retry_interval: float = 5):
+        self.last_call_time = 0.0
         
         self.cookie = cookie
         self.proxy = proxy
+        self.lifetime = lifetime
+        self.refresh_margin = refresh_margin
+        self.retry_interval = retry_interval
         
-        self.x_crsf_token = None if not on_start else asyncio.run(self.generate_x_csrf_token(self.cookie, self.proxy))
+        self.x_crsf_token: Optional[str] = None
+        self.refreshing: Optional[asyncio.Future] = None
     
     async def __call__(self) -> Union[None, str]:
-        now = time.time()
-        elapsed = now - self.last_call_time
-        
-        if elapsed > 120:
-            self.x_crsf_token = await self.generate_x_csrf_token(self.cookie, self.proxy)
-            if self.x_crsf_token:
-                self.last_call_time = now
+        if not self.x_crsf_token:
+            await self.refresh()
                 
         return self.x_crsf_token
     
+    def start_refresh(self) -> asyncio.Future:
+        # single flight, a burst of rejected tokens causes one logout round trip
+        if not self.refreshing or self.refreshing.done():
+            self.refreshing = asyncio.ensure_future(self._refresh())
+        return self.refreshing
+    
+    async def refresh(self) -> Union[None, str]:
+        return await asyncio.shield(self.start_refresh())
+    
+    async def _refresh(self) -> Union[None, str]:
+        try:
+            x_csrf_token = await self.generate_x_csrf_token(self.cookie, self.proxy)
+        except errors.Request.Failed:
+            return self.x_crsf_token
+        
+        if x_csrf_token:
+            self.update(x_csrf_token)
+        return self.x_crsf_token
+    
+    def update(self, x_csrf_token: str) -> None:
+        # roblox hands out the new token in the header of the 403 that rejected the old one
+        self.x_crsf_token = x_csrf_token
+        self.last_call_time = time.time()
+    
+    async def run(self):
+        while True:
+            refresh_at = self.last_call_time + self.lifetime - self.refresh_margin
+            if time.time() < refresh_at:
+                await asyncio.sleep(refresh_at - time.time())
+                continue
+            
+            previous = self.last_call_time
+            await self.refresh()
+            if self.last_call_time == previous:
+                await asyncio.sleep(self.retry_interval)
+    
     @staticmethod
     async def generate_x_csrf_token(cookie: Union[str, None], proxy: Union[str, None]) -> Union[str, None]:
         response: request.Response
@@ -171,39 +379,97 @@ class XCsrfTokenWaiter:
         return response.response_headers.x_csrf_token
 
 class RolimonsDataScraper:
-    def __init__(self):
-        self.last_call_time = time.time()
-        self.item_data: Dict[str, items.RolimonsData] = None
+    def __init__(self, refresh_interval: float = 600, retry_interval: float = 30, cache_path: Optional[str] = "rolimons_cache.json"):
+        self.refresh_interval = refresh_interval
+        self.retry_interval = retry_interval
+        self.cache_path = cache_path
         
-    async def __call__(self) -> Union[None, Dict[str, items.RolimonsData]]:
-        now = time.time()
-        elapsed = now - self.last_call_time
+        # immutable so the hot path can read it without awaiting or locking, a refresh swaps the whole table
+        self.snapshot: items.RolimonsTable = items.RolimonsTable()
+        self.last_call_time = 0.0
+        self.refreshing: Optional[asyncio.Future] = None
         
-        if elapsed > 600 or not self.item_data:
-            self.item_data = await self.retrieve_item_data()
-            if self.item_data:
-                self.last_call_time = now
+        self.load_snapshot()
+    
+    @property
+    def stale(self) -> bool:
+        return time.time() - self.last_call_time > self.refresh_interval
+    
+    async def __call__(self) -> items.RolimonsTable:
+        if not self.snapshot:
+            await self.refresh()
+        elif self.stale:
+            # stale while revalidate, callers keep the old snapshot while it downloads
+            self.start_refresh()
                 
-        return self.item_data
+        return self.snapshot
     
-    @staticmethod
-    def extract_variable(html: str) -> Union[None, Dict[str, List]]:
-        item_pattern = re.compile(r'var\s+item_details\s*=\s*(\{.*?\});', re.DOTALL)
-
-        match = item_pattern.search(html)
-        if match:
-            js_data = match.group(1)
+    def start_refresh(self) -> asyncio.Future:
+        # single flight, concurrent callers share the running download
+        if not self.refreshing or self.refreshing.done():
+            self.refreshing = asyncio.ensure_future(self._refresh())
+        return self.refreshing
+    
+    async def refresh(self) -> bool:
+        return await asyncio.shield(self.start_refresh())
+    
+    async def _refresh(self) -> bool:
+        try:
+            with metrics.registry.timer("stage_seconds", stage = "rolimons_refresh"):
+                item_data = await self.retrieve_item_data()
+        except errors.Request.Failed:
+            metrics.registry.increment("rolimons_refreshes_total", result = "failed")
+            return False
+        if not item_data:
+            return False
+        
+        metrics.registry.increment("rolimons_refreshes_total", result = "ok")
+        self.publish(item_data, time.time())
+        if self.cache_path:
+            await asyncio.get_running_loop().run_in_executor(None, self.save_snapshot)
+        return True
+    
+    def publish(self, item_data: Mapping[str, items.RolimonsData], timestamp: float) -> None:
+        self.snapshot = item_data if isinstance(item_data, items.RolimonsTable) else items.RolimonsTable.from_mapping(item_data)
+        self.last_call_time = timestamp
+    
+    async def run(self):
+        while True:
+            if self.stale:
+                refreshed = await self.refresh()
+                if not refreshed:
+                    await asyncio.sleep(self.retry_interval)
+                    continue
             
-            try:
-                parsed_data = json.loads(js_data)
-                return parsed_data
-            except json.JSONDecodeError as e:
-                return None
-        else:
-            return None
+            await asyncio.sleep(max(self.last_call_time + self.refresh_interval - time.time(), 0))
+    
+    def load_snapshot(self) -> None:
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return
+        
+        try:
+            with open(self.cache_path, "r") as file:
+                cached = json.load(file)
+            
+            # older caches have no demand column
+            self.publish(items.RolimonsTable.from_rows((int(item_id), *row) for item_id, row in cached["items"].items()), cached["time"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return
+    
+    def save_snapshot(self) -> None:
+        snapshot, timestamp = self.snapshot, self.last_call_time
+        cached = {
+            "time": timestamp,
+            "items": {item_id: [rap, value, demand] for item_id, rap, value, demand in snapshot.rows_with_demand()}
+        }
+        
+        temp_path = f"{self.cache_path}.tmp"
+        with open(temp_path, "w") as file:
+            json.dump(cached, file)
+        os.replace(temp_path, self.cache_path)
     
     @staticmethod
-    async def retrieve_item_data() -> Dict[str, items.RolimonsData]:
+    async def retrieve_item_data() -> Optional[items.RolimonsTable]:
         headers = request.Headers( raw_headers = {
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
             "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
@@ -216,23 +482,14 @@ class RolimonsDataScraper:
         
         response: request.Response
         response = await request.Request(
-            url = "https://www.rolimons.com/catalog",
+            url = request.Routes.ROLIMONS_CATALOG.template,
             method = "get",
+            route = request.Routes.ROLIMONS_CATALOG,
             headers = headers
         ).send()
         
-        item_details = RolimonsDataScraper.extract_variable(response.response_text)
-        if item_details:
-            items_dataclass = {}
-            for item_id, data in item_details.items():
-                items_dataclass[item_id] = items.RolimonsData(
-                    rap = data[8],
-                    value = data[16]
-                )
-            
-            return items_dataclass
-        else:
-            return None
+        # the route only hands back the item_details object, decoding it is the slow part so it runs off the loop
+        return await asyncio.get_running_loop().run_in_executor(None, rolimons.parse_item_details, response.response_body)
 
 class UnlockCookie:
     def __init__(self, cookie: str) -> None:
@@ -1,10 +1,22 @@
-from models import config
+from bootstrap import Bootstrap
 
 import sniper
-import helpers
+import shards
 import asyncio
 
-user_config = config.__init__()
-rolimon_limiteds = helpers.RolimonsDataScraper()
+async def start(path: str = "config.json"):
+    # one loop from launch to shutdown, the connections warmed during startup are the ones the pollers use
+    bootstrap = Bootstrap(path)
+    user_config, rolimon_limiteds = await bootstrap()
 
-asyncio.run(sniper.WatchLimiteds(user_config, rolimon_limiteds)())
+    if user_config.shards.workers > 1:
+        runner = shards.Coordinator(user_config, rolimon_limiteds)
+        watch_limiteds = runner.watch_limiteds
+    else:
+        runner = watch_limiteds = sniper.WatchLimiteds(user_config, rolimon_limiteds, config_path = path)
+
+    watch_limiteds.ui_manager.log_event(bootstrap.summary())
+    await runner()
+
+if __name__ == "__main__": # shard workers are spawned and re-import this module
+    asyncio.run(start())
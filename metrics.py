@@ -0,0 +1,170 @@
+import time
+
+from bisect import bisect_left
+from aiohttp import web
+from urllib.parse import urlsplit
+from contextlib import contextmanager
+from typing import Dict, Tuple, List, Optional, Iterator, Callable
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+proxy_labels: Dict[Optional[str], Optional[str]] = {}
+
+def proxy_label(proxy: Optional[str]) -> Optional[str]:
+    # proxy urls usually carry user:pass@, only scheme://host:port goes into labels, the ui and logs
+    if proxy not in proxy_labels:
+        parts = urlsplit(proxy) if proxy and "://" in proxy else None
+        if parts:
+            proxy_labels[proxy] = f"{parts.scheme}://{parts.netloc.rpartition('@')[2]}"
+        else:
+            proxy_labels[proxy] = proxy.split("/", 1)[0].rpartition("@")[2] if proxy else proxy
+    return proxy_labels[proxy]
+
+class Histogram:
+    __slots__ = ("counts", "total", "count")
+
+    def __init__(self):
+        # last slot is +Inf
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def cumulative(self) -> List[int]:
+        counts, running = [], 0
+        for count in self.counts:
+            running += count
+            counts.append(running)
+        return counts
+
+class Metrics:
+    def __init__(self, prefix: str = "sniper"):
+        self.prefix = prefix
+        self.histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self.counters: Dict[str, Dict[Labels, int]] = {}
+        self.gauges: Dict[str, Dict[Labels, float]] = {}
+        
+        # last state reported by each shard worker process, exported with a shard label
+        self.shards: Dict[int, Tuple[dict, dict, dict]] = {}
+
+        # gauges that are only worth computing when someone reads them, run before every export
+        self.collectors: List[Callable[[], None]] = []
+
+    @staticmethod
+    def labels(labels: Dict[str, object]) -> Labels:
+        return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        histograms = self.histograms.setdefault(name, {})
+        key = self.labels(labels)
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = Histogram()
+        histogram.observe(value)
+
+    def increment(self, name: str, amount: int = 1, **labels) -> None:
+        counters = self.counters.setdefault(name, {})
+        key = self.labels(labels)
+        counters[key] = counters.get(key, 0) + amount
+
+    def set(self, name: str, value: float, **labels) -> None:
+        self.gauges.setdefault(name, {})[self.labels(labels)] = value
+
+    @contextmanager
+    def timer(self, name: str, **labels) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def export(self) -> Tuple[dict, dict, dict]:
+        for collector in self.collectors:
+            collector()
+        return self.histograms, self.counters, self.gauges
+
+    def absorb(self, shard: int, exported: Tuple[dict, dict, dict]) -> None:
+        self.shards[shard] = exported
+
+    def merged(self, kind: int) -> Dict[str, List[Tuple[Labels, object]]]:
+        sources = [((), self.export())] + [((("shard", str(shard)),), exported) for shard, exported in self.shards.items()]
+
+        merged = {}
+        for extra, exported in sources:
+            for name, values in exported[kind].items():
+                merged.setdefault(name, []).extend((labels + extra, value) for labels, value in values.items())
+        return merged
+
+    @staticmethod
+    def format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+        pairs = list(labels) + ([extra] if extra else [])
+        if not pairs:
+            return ""
+        escaped = [(key, value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")) for key, value in pairs]
+        return "{" + ",".join(f"{key}=\"{value}\"" for key, value in escaped) + "}"
+
+    def prometheus(self) -> str:
+        lines = []
+        for name, histograms in self.merged(0).items():
+            metric = f"{self.prefix}_{name}"
+            lines.append(f"# TYPE {metric} histogram")
+            for labels, histogram in histograms:
+                for bound, count in zip(BUCKETS + ("+Inf",), histogram.cumulative()):
+                    lines.append(f"{metric}_bucket{self.format_labels(labels, ('le', str(bound)))} {count}")
+                lines.append(f"{metric}_sum{self.format_labels(labels)} {histogram.total}")
+                lines.append(f"{metric}_count{self.format_labels(labels)} {histogram.count}")
+
+        for name, counters in self.merged(1).items():
+            metric = f"{self.prefix}_{name}"
+            lines.append(f"# TYPE {metric} counter")
+            for labels, count in counters:
+                lines.append(f"{metric}{self.format_labels(labels)} {count}")
+
+        for name, gauges in self.merged(2).items():
+            metric = f"{self.prefix}_{name}"
+            lines.append(f"# TYPE {metric} gauge")
+            for labels, value in gauges:
+                lines.append(f"{metric}{self.format_labels(labels)} {value}")
+
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> dict:
+        return {
+            "buckets": list(BUCKETS),
+            "histograms": {
+                name: [{"labels": dict(labels), "counts": histogram.counts, "sum": histogram.total, "count": histogram.count} for labels, histogram in histograms]
+                for name, histograms in self.merged(0).items()
+            },
+            "counters": {
+                name: [{"labels": dict(labels), "value": count} for labels, count in counters]
+                for name, counters in self.merged(1).items()
+            },
+            "gauges": {
+                name: [{"labels": dict(labels), "value": value} for labels, value in gauges]
+                for name, gauges in self.merged(2).items()
+            }
+        }
+
+    async def serve(self, host: str, port: int) -> web.AppRunner:
+        async def prometheus(_: web.Request) -> web.Response:
+            return web.Response(text = self.prometheus(), content_type = "text/plain")
+
+        async def snapshot(_: web.Request) -> web.Response:
+            return web.json_response(self.snapshot())
+
+        app = web.Application()
+        app.router.add_get("/metrics", prometheus)
+        app.router.add_get("/metrics.json", snapshot)
+
+        runner = web.AppRunner(app, access_log = None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        return runner
+
+registry = Metrics()
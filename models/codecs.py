@@ -0,0 +1,59 @@
+import json
+
+from typing import List, Dict, Optional, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+def loads(body: Union[bytes, str]) -> Union[dict, list]:
+    if orjson:
+        return orjson.loads(body)
+    return json.loads(body)
+
+def dumps(data: Union[dict, list]) -> bytes:
+    if orjson:
+        return orjson.dumps(data)
+    return json.dumps(data, separators = (",", ":")).encode("utf-8")
+
+if msgspec:
+    # only the four fields the sniper reads get decoded, the rest of the payload is skipped by msgspec
+    # attribute names match items.Data so both can be used the same way
+
+    class CatalogItem(msgspec.Struct, rename = {"item_id": "id", "product_id": "productId", "collectible_item_id": "collectibleItemId", "lowest_resale_price": "lowestResalePrice"}, gc = False):
+        item_id: int
+        product_id: Optional[int] = None
+        collectible_item_id: Optional[str] = None
+        lowest_resale_price: Optional[int] = None
+
+    class CatalogDetails(msgspec.Struct, gc = False):
+        data: List[CatalogItem] = []
+
+    class MarketplaceItem(msgspec.Struct, rename = {"item_id": "itemTargetId", "product_id": "productTargetId", "collectible_item_id": "collectibleItemId", "lowest_resale_price": "lowestResalePrice"}, gc = False):
+        item_id: int
+        product_id: Optional[int] = None
+        collectible_item_id: Optional[str] = None
+        lowest_resale_price: Optional[int] = None
+
+    # rolimons item_details rows are long positional arrays, only rap (8), value (16) and demand (17) get decoded
+    RolimonsItem = msgspec.defstruct(
+        "RolimonsItem",
+        [(f"skipped_{index}", msgspec.Raw, msgspec.Raw()) for index in range(8)] + [("rap", Optional[int], None)] +
+        [(f"skipped_{index}", msgspec.Raw, msgspec.Raw()) for index in range(9, 16)] + [("value", Optional[int], None), ("demand", Optional[int], None)],
+        array_like = True,
+        gc = False
+    )
+
+    catalog_details_decoder = msgspec.json.Decoder(CatalogDetails)
+    marketplace_details_decoder = msgspec.json.Decoder(List[MarketplaceItem])
+    rolimons_details_decoder = msgspec.json.Decoder(Dict[str, RolimonsItem])
+else:
+    catalog_details_decoder = None
+    marketplace_details_decoder = None
+    rolimons_details_decoder = None
@@ -2,9 +2,10 @@ import json
 import errors
 import helpers
 import asyncio
+import metrics
 import authenticator
 
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, InitVar
 from typing import Optional, Dict, List, Union, Literal
 from models import request, items
 
@@ -12,29 +13,49 @@ from models import request, items
 class Account:
     cookie: str
     otp_token: str
+    # robux this account may spend per run and how often it may buy, None is unlimited
+    budget: Optional[int] = None
+    max_purchases_per_minute: Optional[float] = None
+    # False leaves authenticate() to the caller, a config reload runs it on the live loop
+    login: InitVar[bool] = True
     
-    x_csrf_token: helpers.XCsrfTokenWaiter
+    x_csrf_token: helpers.XCsrfTokenWaiter = field(init = None)
 
     user_id: str = field(init = None)
     user_name: str = field(init = None)
+    # the cookie as written in config.json, unlocking replaces self.cookie
+    config_cookie: str = field(init = None)
     
         
-    def __post_init__(self) -> Union[None, errors.InvalidCookie]:
-        try:
-            headers = request.Headers(cookies = {".ROBLOSECURITY": self.cookie})
-            
-            response = asyncio.run(
-                request.Request(
-                    url = "https://users.roblox.com/v1/users/authenticated",
+    def __post_init__(self, login: bool) -> Union[None, errors.InvalidCookie]:
+        self.config_cookie = self.cookie
+        if login:
+            asyncio.run(request.session_pool.scoped(self.authenticate()))
+    
+    async def authenticate(self) -> Union[None, errors.InvalidCookie]:
+        async def check():
+            with metrics.registry.timer("stage_seconds", stage = "auth_check"):
+                return await request.Request(
+                    url = request.Routes.AUTHENTICATED.template,
                     method = "get",
-                    headers = headers
+                    route = request.Routes.AUTHENTICATED,
+                    headers = request.Headers(cookies = {".ROBLOSECURITY": self.config_cookie})
                 ).send()
-            )
-            
-            self.cookie = asyncio.run(helpers.UnlockCookie(self.cookie)())
+        
+        async def unlock():
+            with metrics.registry.timer("stage_seconds", stage = "cookie_unlock"):
+                return await helpers.UnlockCookie(self.config_cookie)()
+        
+        try:
+            # the user lookup and the ticket unlock both only need the config cookie
+            response, self.cookie = await asyncio.gather(check(), unlock())
             self.user_id = response.response_json.user_id
             self.user_name = response.response_json.user_name
-            self.x_csrf_token = helpers.XCsrfTokenWaiter(cookie = self.cookie, on_start = True)
+            
+            # the token belongs to the unlocked cookie so it has to wait for it
+            self.x_csrf_token = helpers.XCsrfTokenWaiter(cookie = self.cookie)
+            with metrics.registry.timer("stage_seconds", stage = "csrf"):
+                await self.x_csrf_token.refresh()
         except errors.Request.Failed as reason:
             raise errors.InvalidCookie(reason)
 
@@ -50,6 +71,106 @@ class BuySettings:
     generic_settings: ItemSettings
     custom_settings: Optional[Dict[str, ItemSettings]] = None
 
+@dataclass
+class SchedulerSettings:
+    initial_rate: float = 1.0
+    min_rate: float = 0.2
+    max_rate: float = 5.0
+    increase: float = 0.1
+    decrease: float = 0.5
+    burst: float = 1.0
+    max_in_flight: int = 2
+    timeout: float = 10.0
+    rate_window: float = 10.0
+
+@dataclass
+class BatchSettings:
+    # caps are the most each endpoint accepts per request
+    catalog_max: int = 120
+    marketplace_max: int = 30
+    min_size: int = 5
+    # polls measured at one size before stepping
+    window: int = 20
+    steps: int = 8
+    decrease: float = 0.5
+    tolerance: float = 0.05
+
+@dataclass
+class HedgeSettings:
+    enabled: bool = True
+    # hedge once the first attempt is slower than this share of recent answers
+    percentile: float = 0.9
+    min_delay: float = 0.05
+    initial_delay: float = 0.3
+    # extra requests allowed per primary request, burst is how many can be saved up
+    max_extra: float = 0.1
+    burst: float = 2.0
+    attempts: int = 5
+    samples: int = 200
+    min_samples: int = 20
+
+@dataclass
+class ProxyHealthSettings:
+    # weight of the newest result in the moving averages
+    alpha: float = 0.1
+    min_samples: int = 10
+    max_error_rate: float = 0.5
+    max_throttle_rate: float = 0.6
+    max_latency: float = 5.0
+    base_cooldown: float = 30.0
+    max_cooldown: float = 600.0
+    recovery_successes: int = 50
+
+@dataclass
+class PrioritySettings:
+    value_weight: float = 1.0
+    volatility_weight: float = 1.0
+    proximity_weight: float = 2.0
+    max_boost: float = 4.0
+
+@dataclass
+class MetricsSettings:
+    host: str = "127.0.0.1"
+    port: Optional[int] = None
+
+@dataclass
+class UISettings:
+    headless: bool = False
+    refresh_per_second: float = 2
+    summary_interval: float = 60
+
+@dataclass
+class ShardSettings:
+    workers: int = 1
+    uvloop: bool = False
+    stats_interval: float = 1
+
+@dataclass
+class StoreSettings:
+    # sqlite file for price history and purchases, None turns it off
+    path: Optional[str] = "observations.db"
+    flush_interval: float = 1
+    max_pending: int = 50000
+    retention_days: Optional[float] = 30
+
+@dataclass
+class DiscoverySettings:
+    # watch every rolimons limited that passes the filters, bounds are inclusive and None is no bound
+    enabled: bool = False
+    min_value: Optional[int] = None
+    max_value: Optional[int] = None
+    min_rap: Optional[int] = None
+    max_rap: Optional[int] = None
+    # rolimons demand 0 (terrible) to 4 (amazing)
+    min_demand: Optional[int] = None
+    # highest value first when more pass than this
+    max_items: Optional[int] = None
+    # item id -> collectible item id, None keeps it in memory only
+    cache_path: Optional[str] = "collectibles_cache.json"
+    batch_size: int = 120
+    batch_interval: float = 1.0
+    retry_interval: float = 30.0
+
 @dataclass
 class Settings:
     webhook: Union[None, str]
@@ -57,6 +178,25 @@ class Settings:
     buy_settings: BuySettings
     limiteds: helpers.Iterator
     proxies: List[str]
+    scheduler: SchedulerSettings = field(default_factory = SchedulerSettings)
+    proxy_health: ProxyHealthSettings = field(default_factory = ProxyHealthSettings)
+    batching: BatchSettings = field(default_factory = BatchSettings)
+    # per route name, only the resellers lookup is hedged for now
+    hedging: Dict[str, HedgeSettings] = field(default_factory = dict)
+    priority: PrioritySettings = field(default_factory = PrioritySettings)
+    metrics: MetricsSettings = field(default_factory = MetricsSettings)
+    ui: UISettings = field(default_factory = UISettings)
+    shards: ShardSettings = field(default_factory = ShardSettings)
+    store: StoreSettings = field(default_factory = StoreSettings)
+    # every account purchases can be routed to, the first one is also used for polling
+    accounts: List[Account] = field(default_factory = list)
+    discovery: DiscoverySettings = field(default_factory = DiscoverySettings)
+    # limiteds listed without a collectible item id, discovery looks them up
+    unresolved_limiteds: List[int] = field(default_factory = list)
+    
+    def __post_init__(self):
+        if not self.accounts:
+            self.accounts = [self.account]
 
 
 def create_item_settings(data):
@@ -67,22 +207,27 @@ def create_item_settings(data):
         price_measurer=data.get("price_measurer")
     )
 
-def __init__() -> Union[Settings, errors.Config.CantAccess, errors.Config.InvalidFormat, errors.Config.MissingValues]:
+def read(path: str = "config.json") -> Union[dict, errors.Config.CantAccess, errors.Config.InvalidFormat]:
     try:
-        config = open("config.json", "r")
-        try:
-            file_json = json.loads(config.read())
-        except Exception as reason:
-            raise errors.InvalidConfigFormat(reason)
-    except Exception as reason:
-        raise errors.CantAccessConfig(reason)
-            
+        with open(path, "r") as config:
+            text = config.read()
+    except OSError as reason:
+        raise errors.Config.CantAccess(reason)
+    
     try:
-        account = Account(
-            cookie = file_json["account"]["cookie"],
-            otp_token = authenticator.AutoPass(file_json["account"]["otp_token"]),
-            x_csrf_token = helpers.XCsrfTokenWaiter(cookie = file_json["account"]["cookie"], proxy = None, on_start = True)
-        )
+        return json.loads(text)
+    except ValueError as reason:
+        raise errors.Config.InvalidFormat(reason)
+
+def __init__(path: str = "config.json") -> Union[Settings, errors.Config.CantAccess, errors.Config.InvalidFormat, errors.Config.MissingValues]:
+    return parse(read(path))
+
+def parse(file_json: dict, login: bool = True) -> Union[Settings, errors.Config.InvalidFormat, errors.Config.MissingValues]:
+    try:
+        accounts_data = file_json.get("accounts") or [file_json["account"]]
+        for account_data in accounts_data:
+            if "cookie" not in account_data or "otp_token" not in account_data:
+                raise errors.Config.MissingValues("Every account needs a cookie and an otp_token")
                 
         buy_settings_data = file_json["buy_settings"]
         buy_settings_generic_data = buy_settings_data["generic_settings"]
@@ -94,10 +239,11 @@ def __init__() -> Union[Settings, errors.Config.CantAccess, errors.Config.Invali
         
         buy_settings_custom_data = buy_settings_data.get("custom_settings")
         
+        custom_settings = {}
         if buy_settings_custom_data:
-            custom_settings = {}
-            
             for item_id, data in buy_settings_custom_data.items():
+                if not str(item_id).isdigit():
+                    raise errors.Config.InvalidFormat(f"custom_settings keys have to be item ids. Received: {item_id}")
                 if data.get("price_measurer") not in ("rap", "value", "value_rap", None):
                     raise errors.Config.InvalidFormat(f"Accepted price_measurers (value, rap, value_rap, None). Received: {data['price_measurer']}")
              
@@ -112,28 +258,136 @@ def __init__() -> Union[Settings, errors.Config.CantAccess, errors.Config.Invali
             
         )
         
-        limiteds = file_json["limiteds"]
-        if not limiteds:
-            raise errors.Config.MissingValues("Limiteds list can not be empty")
-        for limited in limiteds:
-            if len(limited) != 2:
-                raise errors.Config.MissingValues("Limited needs both item id and collectible item id")
+        try:
+            discovery = DiscoverySettings(**file_json.get("discovery", {}))
+        except TypeError as reason:
+            raise errors.Config.InvalidFormat(reason)
+        if not 1 <= discovery.batch_size <= 120 or discovery.batch_interval < 0 or discovery.retry_interval <= 0:
+            raise errors.Config.InvalidFormat("discovery needs a batch_size of 1-120, batch_interval of at least 0 and retry_interval above 0")
+        
+        # [item_id, collectible_item_id] is watched right away, a bare item_id or [item_id] waits for its collectible item id
+        limiteds, unresolved_limiteds = [], []
+        for limited in file_json.get("limiteds") or []:
+            if isinstance(limited, int):
+                unresolved_limiteds.append(limited)
+            elif isinstance(limited, list) and len(limited) == 1 and isinstance(limited[0], int):
+                unresolved_limiteds.append(limited[0])
+            elif isinstance(limited, list) and len(limited) == 2:
+                limiteds.append(limited)
+            else:
+                raise errors.Config.MissingValues("Limited needs to be an item id or [item id, collectible item id]")
+        if not (limiteds or unresolved_limiteds or discovery.enabled):
+            raise errors.Config.MissingValues("Limiteds list can not be empty without discovery")
         
         proxies = file_json["proxies"]
         if not proxies:
             raise errors.Config.MissingValues("Proxy list can not be empty")
         
+        scheduler_data = file_json.get("scheduler", {})
+        try:
+            scheduler = SchedulerSettings(**scheduler_data)
+        except TypeError as reason:
+            raise errors.Config.InvalidFormat(reason)
+        if not 0 < scheduler.min_rate <= scheduler.initial_rate <= scheduler.max_rate:
+            raise errors.Config.InvalidFormat("Scheduler rates need 0 < min_rate <= initial_rate <= max_rate")
+        
+        try:
+            batching = BatchSettings(**file_json.get("batching", {}))
+        except TypeError as reason:
+            raise errors.Config.InvalidFormat(reason)
+        if not (1 <= batching.catalog_max <= 120 and 1 <= batching.marketplace_max <= 30):
+            raise errors.Config.InvalidFormat("batching caps are 1-120 for catalog_max and 1-30 for marketplace_max")
+        if batching.min_size < 1 or batching.window < 1 or batching.steps < 1 or not 0 < batching.decrease < 1:
+            raise errors.Config.InvalidFormat("batching needs min_size, window and steps of at least 1 and 0 < decrease < 1")
+        
+        try:
+            hedging = {name: HedgeSettings(**data) for name, data in file_json.get("hedging", {}).items()}
+        except TypeError as reason:
+            raise errors.Config.InvalidFormat(reason)
+        for name, hedge_settings in hedging.items():
+            if name not in [route.name for route in request.Routes.all]:
+                raise errors.Config.InvalidFormat(f"hedging has settings for unknown endpoint {name}")
+            if not 0 < hedge_settings.percentile < 1 or hedge_settings.attempts < 1 or hedge_settings.max_extra < 0:
+                raise errors.Config.InvalidFormat(f"hedging.{name} needs 0 < percentile < 1, attempts of at least 1 and max_extra of at least 0")
+        
+        try:
+            proxy_health = ProxyHealthSettings(**file_json.get("proxy_health", {}))
+        except TypeError as reason:
+            raise errors.Config.InvalidFormat(reason)
+        if not 0 < proxy_health.alpha <= 1 or proxy_health.base_cooldown <= 0 or proxy_health.max_latency <= 0:
+            raise errors.Config.InvalidFormat("proxy_health needs 0 < alpha <= 1 and base_cooldown, max_latency above 0")
+        
+        try:
+            priority = PrioritySettings(**file_json.get("priority", {}))
+        except TypeError as reason:
+            raise errors.Config.InvalidFormat(reason)
+        if priority.max_boost < 1:
+            raise errors.Config.InvalidFormat("priority.max_boost can not be lower than 1")
+        
+        try:
+            metrics = MetricsSettings(**file_json.get("metrics", {}))
+        except TypeError as reason:
+            raise errors.Config.InvalidFormat(reason)
+        
+        try:
+            ui = UISettings(**file_json.get("ui", {}))
+        except TypeError as reason:
+            raise errors.Config.InvalidFormat(reason)
+        if ui.refresh_per_second <= 0:
+            raise errors.Config.InvalidFormat("ui.refresh_per_second has to be above 0")
+        
+        try:
+            shards = ShardSettings(**file_json.get("shards", {}))
+        except TypeError as reason:
+            raise errors.Config.InvalidFormat(reason)
+        if shards.workers < 1 or shards.stats_interval <= 0:
+            raise errors.Config.InvalidFormat("shards.workers has to be at least 1 and shards.stats_interval above 0")
+        
+        try:
+            store = StoreSettings(**file_json.get("store", {}))
+        except TypeError as reason:
+            raise errors.Config.InvalidFormat(reason)
+        if store.flush_interval <= 0:
+            raise errors.Config.InvalidFormat("store.flush_interval has to be above 0")
+        
+        # accounts last, logging in is the slow part and the rest of the file is valid by now
+        accounts = [
+            Account(
+                cookie = account_data["cookie"],
+                otp_token = authenticator.AutoPass(account_data["otp_token"]),
+                budget = account_data.get("budget"),
+                max_purchases_per_minute = account_data.get("max_purchases_per_minute"),
+                login = login
+            )
+            for account_data in accounts_data
+        ]
+        
         settings = Settings(
             webhook = file_json.get("webhook"),
-            account = account,
+            account = accounts[0],
+            accounts = accounts,
             buy_settings = buy_settings,
             limiteds = helpers.Iterator(data = [items.Generic(item_id = limited[0], collectible_item_id = limited[1]) 
-                                                for limited in limiteds]),
-            proxies = proxies
+                                                for limited in limiteds], settings = priority),
+            proxies = proxies,
+            scheduler = scheduler,
+            proxy_health = proxy_health,
+            batching = batching,
+            hedging = hedging,
+            priority = priority,
+            metrics = metrics,
+            ui = ui,
+            shards = shards,
+            store = store,
+            discovery = discovery,
+            unresolved_limiteds = unresolved_limiteds
         )
         
         return settings
     
     except KeyError as reason:
         raise errors.Config.MissingValues(reason)
+    except (TypeError, AttributeError, ValueError) as reason:
+        # right json, wrong shape, like a number where an object belongs
+        raise errors.Config.InvalidFormat(reason)
     
\ No newline at end of file
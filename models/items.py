@@ -1,5 +1,8 @@
 from dataclasses import dataclass, field   
-from typing import Literal
+from typing import Literal, Iterable, Iterator, Tuple, Union, Optional
+from collections.abc import Mapping
+from bisect import bisect_left
+from array import array
 
 import uuid
 
@@ -7,6 +10,72 @@ import uuid
 class RolimonsData:
     rap: int
     value: int
+    # rolimons demand 0 (terrible) to 4 (amazing), -1 when not rated
+    demand: int = -1
+
+class RolimonsTable(Mapping):
+    # rolimons rap / value as parallel arrays sorted by item id, RolimonsData is only built on lookup
+    # read only like the snapshot it replaces, keys are str item ids but int ids work too
+    __slots__ = ("ids", "raps", "values", "demands")
+    
+    def __init__(self, ids: Optional[array] = None, raps: Optional[array] = None, values: Optional[array] = None, demands: Optional[array] = None):
+        self.ids = ids if ids is not None else array("q")
+        self.raps = raps if raps is not None else array("q")
+        self.values = values if values is not None else array("q")
+        self.demands = demands if demands is not None else array("b", [-1]) * len(self.ids)
+    
+    @classmethod
+    def from_rows(cls, rows: Iterable[Tuple[int, Optional[int], Optional[int]]]) -> "RolimonsTable":
+        table = cls()
+        # missing rap / value is stored as -1, compile_item already treats <= 0 as unknown, demand is an optional 4th column
+        for item_id, rap, value, *demand in sorted(rows):
+            table.ids.append(item_id)
+            table.raps.append(-1 if rap is None else rap)
+            table.values.append(-1 if value is None else value)
+            table.demands.append(-1 if not demand or demand[0] is None else max(min(demand[0], 100), -1))
+        return table
+    
+    @classmethod
+    def from_mapping(cls, data: Mapping) -> "RolimonsTable":
+        return cls.from_rows((int(item_id), item.rap, item.value, item.demand) for item_id, item in data.items())
+    
+    def index(self, item_id: Union[int, str]) -> int:
+        try:
+            item_id = int(item_id)
+        except (TypeError, ValueError):
+            return -1
+        
+        position = bisect_left(self.ids, item_id)
+        if position < len(self.ids) and self.ids[position] == item_id:
+            return position
+        return -1
+    
+    def rows(self) -> Iterator[Tuple[int, int, int]]:
+        return zip(self.ids, self.raps, self.values)
+    
+    def rows_with_demand(self) -> Iterator[Tuple[int, int, int, int]]:
+        return zip(self.ids, self.raps, self.values, self.demands)
+    
+    def get(self, item_id: Union[int, str], default: Optional[RolimonsData] = None) -> Optional[RolimonsData]:
+        position = self.index(item_id)
+        if position < 0:
+            return default
+        return RolimonsData(rap = self.raps[position], value = self.values[position], demand = self.demands[position])
+    
+    def __getitem__(self, item_id: Union[int, str]) -> RolimonsData:
+        item = self.get(item_id)
+        if item is None:
+            raise KeyError(item_id)
+        return item
+    
+    def __contains__(self, item_id: object) -> bool:
+        return self.index(item_id) >= 0
+    
+    def __iter__(self) -> Iterator[str]:
+        return (str(item_id) for item_id in self.ids)
+    
+    def __len__(self) -> int:
+        return len(self.ids)
     
 @dataclass
 class BuyData:
@@ -26,6 +95,8 @@ class BuyData:
     
 @dataclass
 class Data:
+    __slots__ = ("item_id", "product_id", "collectible_item_id", "lowest_resale_price")
+    
     item_id: int
     product_id: int
     collectible_item_id: str
@@ -1,11 +1,86 @@
 import re
+import time
 import errors
+import asyncio
+import metrics
 import aiohttp
 import authenticator
 
+from urllib.parse import urlsplit
 from dataclasses import dataclass, field, fields, is_dataclass
-from typing import List, Optional, Union, Callable, Awaitable
-from models import items
+from typing import List, Optional, Union, Callable, Awaitable, Dict, Tuple, Set, TYPE_CHECKING
+from models import items, codecs, rolimons
+
+if TYPE_CHECKING:
+    from helpers import XCsrfTokenWaiter
+
+class SessionPool:
+    def __init__(self, limit: int = 100, limit_per_host: int = 20, keepalive_timeout: float = 60, ttl_dns_cache: int = 300):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.ttl_dns_cache = ttl_dns_cache
+        
+        self.sessions: Dict[Tuple[Optional[str], str], aiohttp.ClientSession] = {}
+        # ids of the sessions in self.sessions, every send asks whether its session is pooled
+        self.pooled: Set[int] = set()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        
+        # host -> base url, lets the benchmark point every endpoint at a local stand in
+        self.overrides: Dict[str, str] = {}
+    
+    def rewrite(self, url: str) -> str:
+        if not self.overrides:
+            return url
+        
+        parts = urlsplit(url)
+        base = self.overrides.get(parts.netloc)
+        if not base:
+            return url
+        return base + url[len(parts.scheme) + 3 + len(parts.netloc):]
+    
+    def get(self, url: str, proxy: Optional[str] = None) -> aiohttp.ClientSession:
+        loop = asyncio.get_running_loop()
+        if loop is not self.loop:
+            # sessions are bound to the loop that made them, every asyncio.run gets a fresh set
+            self.sessions = {}
+            self.pooled = set()
+            self.loop = loop
+        
+        key = (proxy, urlsplit(url).netloc)
+        session = self.sessions.get(key)
+        if session is None or session.closed:
+            if session is not None:
+                self.pooled.discard(id(session))
+            connector = aiohttp.TCPConnector(
+                limit = self.limit,
+                limit_per_host = self.limit_per_host,
+                keepalive_timeout = self.keepalive_timeout,
+                ttl_dns_cache = self.ttl_dns_cache,
+                use_dns_cache = True
+            )
+            # shared sessions must not leak cookies between accounts / requests
+            session = self.sessions[key] = aiohttp.ClientSession(connector = connector, cookie_jar = aiohttp.DummyCookieJar())
+            self.pooled.add(id(session))
+            
+        return session
+    
+    def owns(self, session: aiohttp.ClientSession) -> bool:
+        return id(session) in self.pooled
+    
+    async def close(self) -> None:
+        sessions = list(self.sessions.values())
+        self.sessions = {}
+        self.pooled = set()
+        await asyncio.gather(*[session.close() for session in sessions if not session.closed], return_exceptions = True)
+    
+    async def scoped(self, coroutine: Awaitable):
+        try:
+            return await coroutine
+        finally:
+            await self.close()
+
+session_pool = SessionPool()
 
 class ResponseJsons:
     
@@ -38,67 +113,87 @@ class ResponseJsons:
         verificationToken: str
         
     @staticmethod
-    def validate_json(url, response_json: dict) -> Union[None, "ResponseJsons.ItemDetails", "ResponseJsons.CookieInfo", "ResponseJsons.ResaleResponse", "ResponseJsons.TwoStepVerification"]:
-        if url == "https://catalog.roblox.com/v1/catalog/items/details":
-            items_return = []
-            
-            for item in response_json.get("data", []):
-                items_return.append(
-                    items.Data(
-                        item_id = item["id"],
-                        product_id = item["productId"],
-                        collectible_item_id = item["collectibleItemId"],
-                        lowest_resale_price = item["lowestResalePrice"]
-                    )
-                )
-            
-            return ResponseJsons.ItemDetails(items = items_return)
+    def decode_catalog_details(response_json: dict) -> "ResponseJsons.ItemDetails":
+        items_return = []
         
-        elif url == "https://apis.roblox.com/marketplace-items/v1/items/details":
-            items_return = []
-            
-            for item in response_json:
-                items_return.append(
-                    items.Data(
-                        item_id = item["itemTargetId"],
-                        product_id = item["productTargetId"],
-                        collectible_item_id = item["collectibleItemId"],
-                        lowest_resale_price = item["lowestResalePrice"]
-                    )
+        for item in response_json.get("data", []):
+            items_return.append(
+                items.Data(
+                    item_id = item["id"],
+                    product_id = item["productId"],
+                    collectible_item_id = item["collectibleItemId"],
+                    lowest_resale_price = item["lowestResalePrice"]
                 )
-            
-            return ResponseJsons.ItemDetails(items = items_return)
-        
-        elif url == "https://users.roblox.com/v1/users/authenticated":
-                        
-            return ResponseJsons.CookieInfo(
-                user_id = response_json["id"],
-                user_name = response_json["name"],
-                display_name = response_json["displayName"]
             )
         
-        elif re.match(r"^https://apis.roblox.com/marketplace-sales/v1/item/.*/purchase-resale$", url):
-            return ResponseJsons.BuyResponse(
-                purchased_result = response_json["purchaseResult"],
-                purchased = response_json["purchased"],
-                pending = response_json["pending"],
-                error_message = response_json["errorMessage"]
-            )
-            
-        elif re.match(r"^https://apis.roblox.com/marketplace-sales/v1/item/.*/resellers\?limit=1$", url):
-            
-            return ResponseJsons.ResaleResponse(
-                collectible_item_instance_id = response_json["data"][0]["collectibleItemInstanceId"],
-                collectible_product_id = response_json["data"][0]["collectibleProductId"],
-                seller_id = response_json["data"][0]["seller"]["sellerId"],
-                price = response_json["data"][0]["price"]
-            )
+        return ResponseJsons.ItemDetails(items = items_return)
+    
+    @staticmethod
+    def decode_marketplace_details(response_json: list) -> "ResponseJsons.ItemDetails":
+        items_return = []
         
-        elif url == "https://twostepverification.roblox.com/v1/users/3254298971/challenges/authenticator/verify":
-            
-            return ResponseJsons.TwoStepVerification(
-                verificationToken = response_json["verificationToken"]
+        for item in response_json:
+            items_return.append(
+                items.Data(
+                    item_id = item["itemTargetId"],
+                    product_id = item["productTargetId"],
+                    collectible_item_id = item["collectibleItemId"],
+                    lowest_resale_price = item["lowestResalePrice"]
+                )
             )
+        
+        return ResponseJsons.ItemDetails(items = items_return)
+    
+    @staticmethod
+    def decode_catalog_details_body(body: bytes) -> "ResponseJsons.ItemDetails":
+        if codecs.catalog_details_decoder:
+            return ResponseJsons.ItemDetails(items = codecs.catalog_details_decoder.decode(body).data)
+        return ResponseJsons.decode_catalog_details(codecs.loads(body))
+    
+    @staticmethod
+    def decode_marketplace_details_body(body: bytes) -> "ResponseJsons.ItemDetails":
+        if codecs.marketplace_details_decoder:
+            return ResponseJsons.ItemDetails(items = codecs.marketplace_details_decoder.decode(body))
+        return ResponseJsons.decode_marketplace_details(codecs.loads(body))
+    
+    @staticmethod
+    def decode_cookie_info(response_json: dict) -> "ResponseJsons.CookieInfo":
+        return ResponseJsons.CookieInfo(
+            user_id = response_json["id"],
+            user_name = response_json["name"],
+            display_name = response_json["displayName"]
+        )
+    
+    @staticmethod
+    def decode_buy_response(response_json: dict) -> "ResponseJsons.BuyResponse":
+        return ResponseJsons.BuyResponse(
+            purchased_result = response_json["purchaseResult"],
+            purchased = response_json["purchased"],
+            pending = response_json["pending"],
+            error_message = response_json["errorMessage"]
+        )
+    
+    @staticmethod
+    def decode_resale_response(response_json: dict) -> "ResponseJsons.ResaleResponse":
+        return ResponseJsons.ResaleResponse(
+            collectible_item_instance_id = response_json["data"][0]["collectibleItemInstanceId"],
+            collectible_product_id = response_json["data"][0]["collectibleProductId"],
+            seller_id = response_json["data"][0]["seller"]["sellerId"],
+            price = response_json["data"][0]["price"]
+        )
+    
+    @staticmethod
+    def decode_two_step_verification(response_json: dict) -> "ResponseJsons.TwoStepVerification":
+        return ResponseJsons.TwoStepVerification(
+            verificationToken = response_json["verificationToken"]
+        )
+    
+    @staticmethod
+    def validate_json(url, response_json: dict) -> Union[None, "ResponseJsons.ItemDetails", "ResponseJsons.CookieInfo", "ResponseJsons.ResaleResponse", "ResponseJsons.TwoStepVerification"]:
+        # slow path for requests sent without a route
+        route = Routes.resolve(url)
+        if route and route.decode:
+            return route.decode(response_json)
             
 class RequestJsons:
     
@@ -106,30 +201,133 @@ class RequestJsons:
     class WebhookMessage: # adding more fields later on
         content: str 
     
+    @staticmethod
+    def encode_marketplace_details(data: List[items.Generic]) -> dict:
+        return {"itemIds": [item.collectible_item_id for item in data]}
+    
+    @staticmethod
+    def encode_catalog_details(data: List[items.Generic]) -> dict:
+        return {"items": [{"id": item.item_id} for item in data]}
+    
+    @staticmethod
+    def encode_purchase_resale(data: items.BuyData) -> dict:
+        return {
+            "collectibleItemId": data.collectible_item_id,
+            "collectibleItemInstanceId": data.collectible_item_instance_id, # from resale data pls
+            "collectibleProductId": data.collectible_product_id,
+            "expectedCurrency": data.expected_currency,
+            "expectedPrice": data.expected_price,
+            "expectedPurchaserId": data.expected_purchaser_id,
+            "expectedPurchaserType": data.expected_purchaser_type,
+            "expectedSeller": data.expected_seller_id,
+            "expectedSellerType": data.expected_seller_type,
+            "idempotencyKey": data.idempotency_key
+        }
+    
+    @staticmethod
+    def encode_webhook(data: "RequestJsons.WebhookMessage") -> dict:
+        return {
+            "content": data.content
+        }
+    
+    @staticmethod
     def jsonify_api_broad(url: str, data: Union["RequestJsons.WebhookMessage", items.BuyData, List[items.Generic]]) -> dict:
-        if url == "https://apis.roblox.com/marketplace-items/v1/items/details":
-            return {"itemIds": [item.collectible_item_id for item in data]}
-        elif url == "https://catalog.roblox.com/v1/catalog/items/details":
-            return {"items": [{"id": item.item_id} for item in data]}
-        elif re.match(r"^https://apis.roblox.com/marketplace-sales/v1/item/.*/purchase-resale$", url):
-            return {
-                "collectibleItemId": data.collectible_item_id,
-                "collectibleItemInstanceId": data.collectible_item_instance_id, # from resale data pls
-                "collectibleProductId": data.collectible_product_id,
-                "expectedCurrency": data.expected_currency,
-                "expectedPrice": data.expected_price,
-                "expectedPurchaserId": data.expected_purchaser_id,
-                "expectedPurchaserType": data.expected_purchaser_type,
-                "expectedSeller": data.expected_seller_id,
-                "expectedSellerType": data.expected_seller_type,
-                "idempotencyKey": data.idempotency_key
-            }
-        
-        elif re.match(r"^https:\/\/(?:canary\.|ptb\.)?discord(app)?\.com\/api\/webhooks\/\d+\/[\w-]+$", url):
-            
-            return {
-                "content": data.content
-            }
+        # slow path for requests sent without a route
+        route = Routes.resolve(url)
+        if route and route.encode:
+            return route.encode(data)
+
+@dataclass(frozen = True)
+class Route:
+    name: str
+    pattern: "re.Pattern"
+    template: Optional[str] = None
+    
+    decode: Optional[Callable[[Union[dict, list]], object]] = None
+    encode: Optional[Callable[[object], Union[dict, list]]] = None
+    
+    # typed decoder straight from the raw body, skips building the intermediate dict
+    decode_body: Optional[Callable[[bytes], object]] = None
+    keep_text: bool = False
+    # raw bytes on the response, for bodies parsed from bytes where decoding to text would be wasted work
+    keep_body: bool = False
+    # streams a successful response and returns only the part of the body that is needed
+    read_body: Optional[Callable[[aiohttp.ClientResponse], Awaitable[bytes]]] = None
+    
+    def url(self, **params) -> str:
+        return self.template.format(**params)
+    
+    def decode_response(self, body: bytes) -> object:
+        if self.decode_body:
+            return self.decode_body(body)
+        if self.decode:
+            return self.decode(codecs.loads(body))
+        return None
+
+class Routes:
+    CATALOG_DETAILS = Route(
+        name = "catalog_details",
+        pattern = re.compile(r"^https://catalog\.roblox\.com/v1/catalog/items/details$"),
+        template = "https://catalog.roblox.com/v1/catalog/items/details",
+        decode = ResponseJsons.decode_catalog_details,
+        decode_body = ResponseJsons.decode_catalog_details_body,
+        encode = RequestJsons.encode_catalog_details
+    )
+    MARKETPLACE_DETAILS = Route(
+        name = "marketplace_details",
+        pattern = re.compile(r"^https://apis\.roblox\.com/marketplace-items/v1/items/details$"),
+        template = "https://apis.roblox.com/marketplace-items/v1/items/details",
+        decode = ResponseJsons.decode_marketplace_details,
+        decode_body = ResponseJsons.decode_marketplace_details_body,
+        encode = RequestJsons.encode_marketplace_details
+    )
+    RESELLERS = Route(
+        name = "resellers",
+        pattern = re.compile(r"^https://apis\.roblox\.com/marketplace-sales/v1/item/[^/]+/resellers\?limit=1$"),
+        template = "https://apis.roblox.com/marketplace-sales/v1/item/{collectible_item_id}/resellers?limit=1",
+        decode = ResponseJsons.decode_resale_response
+    )
+    PURCHASE_RESALE = Route(
+        name = "purchase_resale",
+        pattern = re.compile(r"^https://apis\.roblox\.com/marketplace-sales/v1/item/[^/]+/purchase-resale$"),
+        template = "https://apis.roblox.com/marketplace-sales/v1/item/{collectible_item_id}/purchase-resale",
+        decode = ResponseJsons.decode_buy_response,
+        encode = RequestJsons.encode_purchase_resale
+    )
+    AUTHENTICATED = Route(
+        name = "authenticated",
+        pattern = re.compile(r"^https://users\.roblox\.com/v1/users/authenticated$"),
+        template = "https://users.roblox.com/v1/users/authenticated",
+        decode = ResponseJsons.decode_cookie_info
+    )
+    TWO_STEP_VERIFICATION = Route(
+        name = "two_step_verification",
+        pattern = re.compile(r"^https://twostepverification\.roblox\.com/v1/users/\d+/challenges/authenticator/verify$"),
+        template = "https://twostepverification.roblox.com/v1/users/{user_id}/challenges/authenticator/verify",
+        decode = ResponseJsons.decode_two_step_verification
+    )
+    ROLIMONS_CATALOG = Route(
+        name = "rolimons_catalog",
+        pattern = re.compile(r"^https://www\.rolimons\.com/catalog$"),
+        template = "https://www.rolimons.com/catalog",
+        # get_encoding() can not run on a body that was streamed through read_body, the parser takes bytes anyway
+        keep_body = True,
+        read_body = rolimons.read_item_details
+    )
+    WEBHOOK = Route(
+        name = "webhook",
+        pattern = re.compile(r"^https:\/\/(?:canary\.|ptb\.)?discord(app)?\.com\/api\/webhooks\/\d+\/[\w-]+$"),
+        encode = RequestJsons.encode_webhook
+    )
+    
+    all = (CATALOG_DETAILS, MARKETPLACE_DETAILS, RESELLERS, PURCHASE_RESALE, AUTHENTICATED, TWO_STEP_VERIFICATION, ROLIMONS_CATALOG, WEBHOOK)
+    
+    @staticmethod
+    def resolve(url: str) -> Optional[Route]:
+        for route in Routes.all:
+            if route.pattern.match(url):
+                return route
+        return None
         
 @dataclass
 class Headers:
@@ -143,7 +341,8 @@ class Response:
     
     response_headers: Headers
     response_json: Union[None, ResponseJsons.ItemDetails, ResponseJsons.CookieInfo, ResponseJsons.BuyResponse]
-    response_text: str
+    response_text: Optional[str] = None
+    response_body: Optional[bytes] = None
 
 @dataclass
 class Request:
@@ -160,26 +359,56 @@ class Request:
 
     success_status_codes: Optional[List[int]] = field(default_factory=lambda: [200])
     retries: Optional[int] = 1
+    timeout: Optional[float] = None
+    
+    route: Optional[Route] = None
+    # when set, a 403 that rejects the token updates the waiter and the request is retried once with the new token
+    x_csrf_token: Optional["XCsrfTokenWaiter"] = None
     
     otp_token: Optional["authenticator.AutoPass"] = None
     user_id: Optional[int] = 0
     
     auth: bool = False
     
+    async def send_once(self) -> Tuple[aiohttp.ClientResponse, bytes]:
+        method: Callable[..., Awaitable[aiohttp.ClientResponse]]
+        method = getattr(self.session, self.method)
+        headers = {"x-csrf-token": str(self.headers.x_csrf_token)} if not self.headers.raw_headers else self.headers.raw_headers
+        timeout = {"timeout": aiohttp.ClientTimeout(total = self.timeout)} if self.timeout else {}
+        response = await method(session_pool.rewrite(self.url), headers = headers, cookies = self.headers.cookies, json = self.json_data, proxy = self.proxy, **timeout)
+        if self.route and self.route.read_body and response.status in self.success_status_codes:
+            return response, await self.route.read_body(response)
+        return response, await response.read()
+    
+    def accept_x_csrf_token(self, response: aiohttp.ClientResponse) -> bool:
+        x_csrf_token = response.headers.get("x-csrf-token")
+        if not x_csrf_token or x_csrf_token == self.headers.x_csrf_token:
+            return False
+        
+        self.x_csrf_token.update(x_csrf_token)
+        self.headers.x_csrf_token = x_csrf_token
+        if self.headers.raw_headers and "x-csrf-token" in self.headers.raw_headers:
+            self.headers.raw_headers["x-csrf-token"] = x_csrf_token
+        return True
+    
     async def send(self) -> Union[Response, errors.Request.Failed]:
         if not self.session:
-            self.session = aiohttp.ClientSession()
+            self.session = session_pool.get(self.url, self.proxy)
         
         exceptions = []
         
+        endpoint = self.route.name if self.route else "other"
+        
         for i in range(self.retries):
             try:
-                method: Callable[..., Awaitable[aiohttp.ClientResponse]]
-                method = getattr(self.session, self.method)
-                headers = {"x-csrf-token": str(self.headers.x_csrf_token)} if not self.headers.raw_headers else self.headers.raw_headers
-                response = await method(self.url, headers = headers, cookies = self.headers.cookies, json = self.json_data, proxy = self.proxy)
+                started = time.perf_counter()
+                response, body = await self.send_once()
+                if response.status == 403 and self.x_csrf_token and self.accept_x_csrf_token(response):
+                    response, body = await self.send_once()
+                metrics.registry.observe("request_seconds", time.perf_counter() - started, endpoint = endpoint, proxy = metrics.proxy_label(self.proxy))
+                metrics.registry.increment("responses_total", endpoint = endpoint, status = response.status)
                 if response.status in self.success_status_codes or (response.status == 403 and self.otp_token and self.user_id):
-                    if response.status == 403 and self.otp_token and self.user_id and "Challenge" in await response.text():
+                    if response.status == 403 and self.otp_token and self.user_id and b"Challenge" in body:
                         challange_data = authenticator.ChallangeData(
                             rblx_challange_id = response.headers.get("rblx-challenge-id"),
                             rblx_challange_metadata = response.headers.get("rblx-challenge-metadata"),
@@ -190,23 +419,33 @@ class Request:
                         return await request_formatted.send()
                         
                     response_cookies = {cookie.key: cookie.value for cookie in self.session.cookie_jar}
+                    response_cookies.update({key: morsel.value for key, morsel in response.cookies.items()})
                     response_headers = Headers(x_csrf_token = response.headers.get("x-csrf-token"), cookies = response_cookies, raw_headers = dict(response.headers))
                     
                     try:
-                        response_json = ResponseJsons.validate_json(self.url, await response.json())
+                        if self.route:
+                            response_json = self.route.decode_response(body)
+                        else:
+                            response_json = ResponseJsons.validate_json(self.url, codecs.loads(body))
                     except:
                         response_json = None
-                    if self.close_session:
+                    if self.close_session and not session_pool.owns(self.session):
                         await self.session.close()  
                     
-                    return Response(status_code = response.status, response_headers = response_headers, response_json = response_json, response_text = await response.text())                    
+                    # only route-less requests (auth tickets) and routes asking for it keep the text
+                    response_text = body.decode(response.get_encoding(), errors = "replace") if not self.route or self.route.keep_text else None
+                    response_body = body if self.route and self.route.keep_body else None
+                    
+                    return Response(status_code = response.status, response_headers = response_headers, response_json = response_json, response_text = response_text, response_body = response_body)                    
                 else:
-                    print(await response.text())
-                    raise errors.Request.InvalidStatus(response.status)
+                    # 429s are routine now that the rate limiter probes for them, counted instead of printed
+                    metrics.registry.increment("request_status_total", endpoint = endpoint, status = response.status)
+                    raise errors.Request.InvalidStatus(response.status, dict(response.headers))
             except Exception as reason:
                 exceptions.append(reason)
+                metrics.registry.increment("request_errors_total", endpoint = endpoint, kind = type(reason).__name__)
         
-        if self.close_session:
+        if self.close_session and not session_pool.owns(self.session):
             await self.session.close()
         
         raise errors.Request.Failed(exceptions)
\ No newline at end of file
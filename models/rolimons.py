@@ -0,0 +1,82 @@
+import aiohttp
+
+from typing import Optional, Union
+
+from models import codecs, items
+
+MARKER = b"item_details"
+# enough to hold "var item_details = {" split across two chunks
+TAIL = 64
+
+def find_item_details(buffer: Union[bytes, bytearray], start: int = 0) -> Optional[int]:
+    # offset of the "{" that opens "var item_details = {", plain finds instead of a regex over the page
+    while True:
+        index = buffer.find(MARKER, start)
+        if index == -1:
+            return None
+        start = index + len(MARKER)
+
+        before = bytes(buffer[max(index - 16, 0):index])
+        if not before[-1:].isspace() or not before.rstrip().endswith(b"var"):
+            continue
+
+        position = start
+        while position < len(buffer) and buffer[position:position + 1].isspace():
+            position += 1
+        if buffer[position:position + 1] != b"=":
+            continue
+
+        position += 1
+        while position < len(buffer) and buffer[position:position + 1].isspace():
+            position += 1
+        if buffer[position:position + 1] == b"{":
+            return position
+
+async def read_item_details(response: aiohttp.ClientResponse, chunk_size: int = 65536) -> bytes:
+    # reads the page in chunks, everything before the variable is thrown away and the rest of the page is never downloaded
+    buffer = bytearray()
+    start = None
+    searched = 0
+
+    async for chunk in response.content.iter_chunked(chunk_size):
+        buffer += chunk
+
+        if start is None:
+            start = find_item_details(buffer)
+            if start is None:
+                del buffer[:max(len(buffer) - TAIL, 0)]
+                continue
+            del buffer[:start]
+
+        # same end as the old non greedy regex, the first "};" after the opening brace
+        end = buffer.find(b"};", max(searched - 1, 0))
+        if end != -1:
+            response.release()
+            return bytes(buffer[:end + 1])
+        searched = len(buffer)
+
+    return b""
+
+def parse_item_details(blob: Union[bytes, str]) -> Optional[items.RolimonsTable]:
+    # cpu heavy, run it in an executor
+    if not blob:
+        return None
+
+    if codecs.rolimons_details_decoder:
+        try:
+            rows = codecs.rolimons_details_decoder.decode(blob)
+            return items.RolimonsTable.from_rows((int(item_id), row.rap, row.value, row.demand) for item_id, row in rows.items())
+        except (codecs.msgspec.DecodeError, ValueError):
+            # odd row types, the generic path below is more forgiving
+            pass
+
+    try:
+        rows = codecs.loads(blob)
+    except ValueError:
+        return None
+
+    def field(row: list, index: int) -> Optional[int]:
+        value = row[index] if len(row) > index else None
+        return int(value) if isinstance(value, (int, float)) else None
+
+    return items.RolimonsTable.from_rows((int(item_id), field(row, 8), field(row, 16), field(row, 17)) for item_id, row in rows.items())
@@ -0,0 +1,100 @@
+import errors
+import asyncio
+import helpers
+
+from collections import deque
+from typing import Optional
+
+from models import request
+
+class Notifier:
+    # purchase events go through a bounded queue, a background sender batches them into webhook messages
+    def __init__(self, webhook: Optional[str], ui_manager: helpers.UIManager, max_queue: int = 100, batch_interval: float = 2.0, max_message_length: int = 2000, max_attempts: int = 3):
+        self.webhook = webhook
+        self.ui_manager = ui_manager
+        self.batch_interval = batch_interval
+        self.max_message_length = max_message_length
+        self.max_attempts = max_attempts
+
+        # oldest events fall off when the webhook can not keep up
+        self.queue: deque = deque(maxlen = max_queue)
+        self.dropped = 0
+        self.event = asyncio.Event()
+
+    def notify(self, message: str, webhook: bool = True) -> None:
+        self.ui_manager.log_event(message)
+        if not webhook or not self.webhook:
+            return
+
+        if len(self.queue) == self.queue.maxlen:
+            self.dropped += 1
+        self.queue.append(message)
+        self.event.set()
+
+    def take_batch(self) -> str:
+        lines = []
+        if self.dropped:
+            lines.append(f"⚠️ {self.dropped} events dropped")
+            self.dropped = 0
+
+        length = sum(len(line) + 1 for line in lines)
+        while self.queue and length + len(self.queue[0]) + 1 <= self.max_message_length:
+            message = self.queue.popleft()
+            lines.append(message)
+            length += len(message) + 1
+
+        if not lines and self.queue:
+            # single event longer than a discord message
+            lines.append(self.queue.popleft()[:self.max_message_length])
+
+        return "\n".join(lines)
+
+    @staticmethod
+    def header(headers: dict, name: str) -> Optional[str]:
+        for key, value in headers.items():
+            if key.lower() == name:
+                return value
+        return None
+
+    def retry_after(self, reason: errors.Request.Failed) -> Optional[float]:
+        for exception in reason.args[0] if reason.args else []:
+            if isinstance(exception, errors.Request.InvalidStatus) and exception.status == 429:
+                retry_after = self.header(exception.headers, "retry-after") or self.header(exception.headers, "x-ratelimit-reset-after")
+                return float(retry_after) if retry_after else self.batch_interval
+        return None
+
+    async def send(self, content: str) -> None:
+        webhook = request.RequestJsons.WebhookMessage(content = content)
+
+        for _ in range(self.max_attempts):
+            try:
+                response = await request.Request(
+                    url = self.webhook,
+                    method = "post",
+                    route = request.Routes.WEBHOOK,
+                    json_data = request.Routes.WEBHOOK.encode(webhook),
+                    success_status_codes = [200, 204],
+                    timeout = 10
+                ).send()
+            except errors.Request.Failed as reason:
+                retry_after = self.retry_after(reason)
+                if retry_after is None:
+                    return
+                await asyncio.sleep(retry_after)
+                continue
+
+            # bucket used up, wait it out before the next message instead of eating a 429
+            headers = response.response_headers.raw_headers or {}
+            if self.header(headers, "x-ratelimit-remaining") == "0":
+                await asyncio.sleep(float(self.header(headers, "x-ratelimit-reset-after") or 0))
+            return
+
+    async def run(self):
+        while True:
+            await self.event.wait()
+            # let a burst of events collect into one message
+            await asyncio.sleep(self.batch_interval)
+            self.event.clear()
+
+            while self.queue or self.dropped:
+                await self.send(self.take_batch())
@@ -0,0 +1,85 @@
+import time
+import metrics
+import thresholds
+
+from array import array
+from typing import Callable, Dict, List, Tuple
+
+from models import items
+
+class PriceStream:
+    # last seen price per watched item, each batch is diffed against it so only moved items get evaluated
+    def __init__(self, buy_thresholds: thresholds.BuyThresholds, limiteds: List[items.Generic], recheck_interval: float = 10):
+        self.thresholds = buy_thresholds
+        self.recheck_interval = recheck_interval
+
+        self.slots: Dict[int, int] = {}
+        # 0 is never seen / no resellers, generation is the thresholds build the slot was last checked against
+        self.prices = array("q")
+        self.generations = array("q")
+        self.emitted = array("d")
+        for item in limiteds:
+            self.slot(item.item_id)
+
+        self.subscribers: List[Callable[[items.Data, int], None]] = []
+
+    def slot(self, item_id: int) -> int:
+        slot = self.slots.get(item_id)
+        if slot is None:
+            slot = self.slots[item_id] = len(self.prices)
+            self.prices.append(0)
+            self.generations.append(-1)
+            self.emitted.append(0.0)
+        return slot
+
+    def restore(self, item_id: int, price: int) -> None:
+        self.prices[self.slot(item_id)] = price or 0
+
+    def retry(self, item_id: int) -> None:
+        # a candidate that could not be handled comes back on the next poll instead of after the recheck interval
+        slot = self.slots.get(item_id)
+        if slot is not None:
+            self.emitted[slot] = 0.0
+
+    def subscribe(self, callback: Callable[[items.Data, int], None]) -> None:
+        # called with the item and its previous price on every price drop
+        self.subscribers.append(callback)
+
+    def diff(self, batch: List[items.Data]) -> Tuple[List[items.Data], List[items.Data]]:
+        self.thresholds.refresh()
+        generation = self.thresholds.generation
+        slots, prices, generations, emitted = self.slots, self.prices, self.generations, self.emitted
+        now = time.monotonic()
+
+        # changed: price moved or thresholds were rebuilt, candidates: what is worth screening for a buy
+        changed, candidates, drops = [], [], []
+        for item in batch:
+            slot = slots.get(item.item_id)
+            if slot is None:
+                slot = self.slot(item.item_id)
+
+            price = item.lowest_resale_price or 0
+            previous = prices[slot]
+            rebuilt = generations[slot] != generation
+
+            if price != previous or rebuilt:
+                changed.append(item)
+                prices[slot] = price
+                generations[slot] = generation
+
+            if not price:
+                continue
+            if price < previous:
+                drops.append((item, previous))
+            # a deal that is still listed comes back once the purchase cooldown is over so a lost or failed buy gets retried
+            if price < previous or rebuilt or not previous or (now - emitted[slot] >= self.recheck_interval and self.thresholds.in_range(item.item_id, price)):
+                candidates.append(item)
+                emitted[slot] = now
+
+        if drops:
+            metrics.registry.increment("price_drops_total", len(drops))
+            for subscriber in self.subscribers:
+                for item, previous in drops:
+                    subscriber(item, previous)
+
+        return changed, candidates
@@ -0,0 +1,361 @@
+import time
+import errors
+import asyncio
+import metrics
+
+from collections import deque
+from typing import Optional, Dict, Tuple, List, Callable, Awaitable, TypeVar
+
+from models import config
+
+T = TypeVar("T")
+
+class AdaptiveRate:
+    # token bucket whose refill rate follows AIMD, healthy responses raise it and throttling halves it
+    def __init__(self, settings: config.SchedulerSettings):
+        self.settings = settings
+
+        self.rate = settings.initial_rate
+        self.tokens = 1.0
+        self.updated = time.monotonic()
+        self.last_decrease = 0.0
+
+        self.sent: deque = deque()
+
+    async def acquire(self) -> None:
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.settings.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+            if self.tokens >= 1:
+                self.tokens -= 1
+                self.sent.append(now)
+                return
+
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def success(self) -> None:
+        # + increase per second at steady state no matter the current rate
+        self.rate = min(self.settings.max_rate, self.rate + self.settings.increase / self.rate)
+
+    def throttled(self) -> None:
+        now = time.monotonic()
+        # one burst of 429s is one congestion signal, dont halve for every request that was already in flight
+        if now - self.last_decrease < 1 / self.rate:
+            return
+
+        self.last_decrease = now
+        self.rate = max(self.settings.min_rate, self.rate * self.settings.decrease)
+        self.tokens = min(self.tokens, 0)
+
+    def achieved_rate(self) -> float:
+        cutoff = time.monotonic() - self.settings.rate_window
+        while self.sent and self.sent[0] < cutoff:
+            self.sent.popleft()
+
+        return len(self.sent) / self.settings.rate_window
+
+class BatchSizer:
+    # hill climbs the batch size on items per second of request time, one window of polls per step
+    # timeouts and rejected batches cut it right away instead of waiting for the window
+    def __init__(self, settings: config.BatchSettings, cap: int):
+        self.settings = settings
+        self.cap = cap
+        self.floor = min(settings.min_size, cap)
+        self.step = max(cap // settings.steps, 1)
+
+        self.size = cap
+        # at the cap the only way to explore is down
+        self.direction = -1
+        self.previous: Optional[float] = None
+
+        self.polls = 0
+        self.items = 0
+        self.elapsed = 0.0
+
+    def resize(self, settings: config.BatchSettings, cap: int) -> None:
+        self.settings = settings
+        self.cap = cap
+        self.floor = min(settings.min_size, cap)
+        self.step = max(cap // settings.steps, 1)
+        self.move(self.size)
+
+    def reset_window(self) -> None:
+        self.polls = self.items = 0
+        self.elapsed = 0.0
+
+    def move(self, size: int) -> None:
+        self.size = max(self.floor, min(self.cap, size))
+        self.reset_window()
+
+    def record(self, size: int, latency: float, reason: Optional[errors.Request.Failed] = None) -> None:
+        if size != self.size:
+            # result from before the last change
+            return
+
+        if reason is not None and BatchSizer.too_large(reason):
+            self.move(int(self.size * self.settings.decrease))
+            # throughput at the new size is unknown, measure it before comparing again
+            self.previous = None
+            self.direction = -1
+            return
+
+        self.polls += 1
+        self.elapsed += latency
+        if reason is None:
+            self.items += size
+        if self.polls < self.settings.window:
+            return
+
+        goodput = self.items / max(self.elapsed, 1e-6)
+        if self.previous is not None and goodput < self.previous * (1 - self.settings.tolerance):
+            self.direction = -self.direction
+        self.previous = goodput
+
+        if self.size + self.direction * self.step > self.cap or self.size + self.direction * self.step < self.floor:
+            self.direction = -self.direction
+        self.move(self.size + self.direction * self.step)
+
+    @staticmethod
+    def too_large(reason: errors.Request.Failed) -> bool:
+        exceptions: List[Exception] = reason.args[0] if reason.args else []
+        for exception in exceptions:
+            if isinstance(exception, asyncio.TimeoutError):
+                return True
+            if isinstance(exception, errors.Request.InvalidStatus) and exception.status in (400, 413, 414):
+                return True
+        return False
+
+class RequestScheduler:
+    def __init__(self, settings: config.SchedulerSettings, batch_settings: Optional[config.BatchSettings] = None):
+        self.settings = settings
+        self.batch_settings = batch_settings or config.BatchSettings()
+        self.buckets: Dict[Tuple[Optional[str], str], AdaptiveRate] = {}
+        self.sizers: Dict[Tuple[Optional[str], str], BatchSizer] = {}
+
+    def bucket(self, proxy: Optional[str], endpoint: str) -> AdaptiveRate:
+        key = (proxy, endpoint)
+        if key not in self.buckets:
+            self.buckets[key] = AdaptiveRate(self.settings)
+        return self.buckets[key]
+
+    def sizer(self, proxy: Optional[str], endpoint: str, cap: int) -> BatchSizer:
+        key = (proxy, endpoint)
+        if key not in self.sizers:
+            self.sizers[key] = BatchSizer(self.batch_settings, cap)
+        return self.sizers[key]
+
+    def update_settings(self, settings: config.SchedulerSettings, batch_settings: config.BatchSettings, caps: Dict[str, int]) -> None:
+        self.settings, self.batch_settings = settings, batch_settings
+        for bucket in self.buckets.values():
+            bucket.settings = settings
+            bucket.rate = max(settings.min_rate, min(settings.max_rate, bucket.rate))
+        for (_, endpoint), sizer in self.sizers.items():
+            sizer.resize(batch_settings, caps.get(endpoint, sizer.cap))
+
+    def remove(self, proxy: Optional[str]) -> None:
+        for key in [key for key in self.buckets if key[0] == proxy]:
+            del self.buckets[key]
+        metrics.registry.set("request_rate", 0, proxy = metrics.proxy_label(proxy))
+        for key in [key for key in self.sizers if key[0] == proxy]:
+            del self.sizers[key]
+
+    def batch_sizes(self) -> Dict[str, float]:
+        sizes: Dict[str, List[int]] = {}
+        for (_, endpoint), sizer in self.sizers.items():
+            sizes.setdefault(endpoint, []).append(sizer.size)
+        return {endpoint: sum(endpoint_sizes) / len(endpoint_sizes) for endpoint, endpoint_sizes in sizes.items()}
+
+    def rates(self) -> Dict[Optional[str], float]:
+        rates = {}
+        for (proxy, _), bucket in self.buckets.items():
+            rates[proxy] = rates.get(proxy, 0) + bucket.achieved_rate()
+        return rates
+
+    def export_rates(self) -> None:
+        for proxy, rate in self.rates().items():
+            metrics.registry.set("request_rate", round(rate, 3), proxy = metrics.proxy_label(proxy))
+
+    @staticmethod
+    def is_throttled(reason: errors.Request.Failed) -> bool:
+        exceptions: List[Exception] = reason.args[0] if reason.args else []
+        for exception in exceptions:
+            if isinstance(exception, errors.Request.InvalidStatus) and exception.status == 429:
+                return True
+            if isinstance(exception, asyncio.TimeoutError):
+                return True
+        return False
+
+class ProxyHealth:
+    # moving averages of latency, errors and 429s, a proxy that goes bad sits out for a cooldown that doubles each time
+    def __init__(self, settings: config.ProxyHealthSettings):
+        self.settings = settings
+
+        self.latency = 0.0
+        self.error_rate = 0.0
+        self.throttle_rate = 0.0
+        self.samples = 0
+
+        self.quarantined_until = 0.0
+        self.strikes = 0
+        self.successes = 0
+
+    def record(self, latency: float, outcome: str) -> None:
+        alpha = self.settings.alpha
+        self.samples += 1
+        self.latency += (latency - self.latency) * alpha
+        self.error_rate += ((outcome == "error") - self.error_rate) * alpha
+        self.throttle_rate += ((outcome == "throttled") - self.throttle_rate) * alpha
+
+        if outcome == "ok":
+            self.successes += 1
+            # long enough clean run after a quarantine and the next one starts from the base cooldown again
+            if self.successes >= self.settings.recovery_successes:
+                self.strikes = 0
+        else:
+            self.successes = 0
+
+    def score(self) -> float:
+        return (1 - self.error_rate) * (1 - self.throttle_rate) / (1 + self.latency / self.settings.max_latency)
+
+    def unhealthy(self) -> bool:
+        return self.samples >= self.settings.min_samples and (
+            self.error_rate > self.settings.max_error_rate or
+            self.throttle_rate > self.settings.max_throttle_rate or
+            self.latency > self.settings.max_latency
+        )
+
+    def quarantined(self, now: Optional[float] = None) -> bool:
+        return (now or time.monotonic()) < self.quarantined_until
+
+    def quarantine(self) -> float:
+        cooldown = min(self.settings.base_cooldown * 2 ** self.strikes, self.settings.max_cooldown)
+        self.quarantined_until = time.monotonic() + cooldown
+        self.strikes += 1
+
+        # back on probation with a clean slate, min_samples new results decide if it goes straight back out
+        self.latency = self.error_rate = self.throttle_rate = 0.0
+        self.samples = self.successes = 0
+        return cooldown
+
+class ProxyPool:
+    def __init__(self, settings: config.ProxyHealthSettings, proxies: List[Optional[str]]):
+        self.settings = settings
+        self.health: Dict[Optional[str], ProxyHealth] = {proxy: ProxyHealth(settings) for proxy in proxies}
+
+    def add(self, proxy: Optional[str]) -> None:
+        if proxy not in self.health:
+            self.health[proxy] = ProxyHealth(self.settings)
+
+    def update_settings(self, settings: config.ProxyHealthSettings) -> None:
+        self.settings = settings
+        for health in self.health.values():
+            health.settings = settings
+
+    def remove(self, proxy: Optional[str]) -> None:
+        self.health.pop(proxy, None)
+        metrics.registry.set("proxy_quarantined", 0, proxy = metrics.proxy_label(proxy))
+
+    def available(self) -> List[Optional[str]]:
+        now = time.monotonic()
+        return [proxy for proxy, health in self.health.items() if not health.quarantined(now)]
+
+    def record(self, proxy: Optional[str], latency: float, reason: Optional[errors.Request.Failed] = None) -> Optional[float]:
+        health = self.health.get(proxy)
+        if health is None:
+            health = self.health[proxy] = ProxyHealth(self.settings)
+
+        outcome = "ok" if reason is None else "throttled" if RequestScheduler.is_throttled(reason) else "error"
+        health.record(latency, outcome)
+        metrics.registry.set("proxy_health_score", round(health.score(), 3), proxy = metrics.proxy_label(proxy))
+
+        # the last healthy proxy never gets pulled, a slow proxy still beats none
+        if not health.unhealthy() or len(self.available()) <= 1:
+            return None
+
+        cooldown = health.quarantine()
+        metrics.registry.increment("proxy_quarantines_total", proxy = metrics.proxy_label(proxy))
+        metrics.registry.set("proxy_quarantined", 1, proxy = metrics.proxy_label(proxy))
+        return cooldown
+
+    async def wait_available(self, proxy: Optional[str]) -> None:
+        health = self.health.get(proxy)
+        if health is None or not health.quarantined():
+            return
+
+        await asyncio.sleep(max(health.quarantined_until - time.monotonic(), 0))
+        metrics.registry.set("proxy_quarantined", 0, proxy = metrics.proxy_label(proxy))
+
+    def ranked(self) -> List[Optional[str]]:
+        # healthiest first, for picking a second route
+        return sorted(self.available(), key = lambda proxy: self.health[proxy].score(), reverse = True)
+
+    def summary(self) -> str:
+        available = len(self.available())
+        return f"{available}/{len(self.health)} healthy" + (f" ({len(self.health) - available} quarantined)" if available < len(self.health) else "")
+
+class Hedger:
+    # if the first attempt is slower than the recent p-th percentile a duplicate goes out on another route, first answer wins
+    # every primary call earns max_extra of a hedge so the extra load stays a fixed fraction
+    def __init__(self, settings: Optional[config.HedgeSettings], endpoint: str):
+        self.settings = settings or config.HedgeSettings()
+        self.endpoint = endpoint
+
+        self.latencies: deque = deque(maxlen = self.settings.samples)
+        self.credits = self.settings.burst
+
+    def delay(self) -> float:
+        if len(self.latencies) < self.settings.min_samples:
+            return self.settings.initial_delay
+
+        ordered = sorted(self.latencies)
+        return max(ordered[min(int(len(ordered) * self.settings.percentile), len(ordered) - 1)], self.settings.min_delay)
+
+    async def __call__(self, attempt: Callable[[Optional[str]], Awaitable[T]], routes: List[Optional[str]]) -> T:
+        self.credits = min(self.credits + self.settings.max_extra, self.settings.burst)
+
+        tasks: Dict[asyncio.Task, float] = {}
+        hedges = set()
+        launched = 0
+        failures: List[Exception] = []
+
+        def launch() -> asyncio.Task:
+            nonlocal launched
+            task = asyncio.ensure_future(attempt(routes[launched % len(routes)]))
+            tasks[task] = time.perf_counter()
+            launched += 1
+            return task
+
+        launch()
+        try:
+            while tasks:
+                hedge = self.settings.enabled and launched == 1 and self.credits >= 1
+                done, _ = await asyncio.wait(tasks, timeout = self.delay() if hedge else None, return_when = asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    # primary is in the slow tail, race it
+                    self.credits -= 1
+                    metrics.registry.increment("hedges_total", endpoint = self.endpoint)
+                    hedges.add(launch())
+                    continue
+
+                for task in done:
+                    started = tasks.pop(task)
+                    if task.exception() is None:
+                        self.latencies.append(time.perf_counter() - started)
+                        if task in hedges:
+                            metrics.registry.increment("hedge_wins_total", endpoint = self.endpoint)
+                        return task.result()
+
+                    reason = task.exception()
+                    failures.extend(reason.args[0] if isinstance(reason, errors.Request.Failed) and reason.args else [reason])
+
+                # failed outright, that is a plain retry on the next route and costs no hedge credit
+                if not tasks and launched < self.settings.attempts:
+                    launch()
+
+            raise errors.Request.Failed(failures)
+        finally:
+            for task in tasks:
+                task.cancel()
@@ -0,0 +1,316 @@
+import queue
+import asyncio
+import helpers
+import metrics
+import sniper
+import threading
+import dataclasses
+import multiprocessing
+
+from dataclasses import dataclass, field
+from multiprocessing.connection import Connection
+from typing import Optional, List, Dict, Tuple, Any
+
+from models import config, items, request
+
+@dataclass
+class ShardAccount:
+    # what a worker needs of the account to poll, it never buys so no otp / user lookup
+    cookie: str
+    user_id: int
+    x_csrf_token: helpers.XCsrfTokenWaiter
+    otp_token: None = None
+    budget: None = None
+    max_purchases_per_minute: None = None
+
+@dataclass
+class ShardConfig:
+    shard_id: int
+    cookie: str
+    user_id: int
+    x_csrf_token: Optional[str]
+
+    limiteds: List[Tuple[int, str]]
+    proxies: List[Optional[str]]
+
+    buy_settings: config.BuySettings
+    scheduler: config.SchedulerSettings
+    priority: config.PrioritySettings
+    batching: config.BatchSettings
+    proxy_health: config.ProxyHealthSettings
+
+    rolimons: items.RolimonsTable
+    rolimons_time: float
+
+    store: config.StoreSettings = field(default_factory = config.StoreSettings)
+    uvloop: bool = False
+    stats_interval: float = 1.0
+    overrides: Dict[str, str] = field(default_factory = dict)
+
+class ShardWorker:
+    def __init__(self, shard: ShardConfig, inbox: Connection, outbox: Connection):
+        self.shard = shard
+        self.inbox = inbox
+        self.outbox = outbox
+
+        self.account = ShardAccount(cookie = shard.cookie, user_id = shard.user_id, x_csrf_token = helpers.XCsrfTokenWaiter(cookie = shard.cookie))
+        if shard.x_csrf_token:
+            self.account.x_csrf_token.update(shard.x_csrf_token)
+
+        self.rolimon_limiteds = helpers.RolimonsDataScraper(cache_path = None)
+        self.rolimon_limiteds.publish(shard.rolimons, shard.rolimons_time)
+
+        request.session_pool.overrides = shard.overrides
+
+        settings = config.Settings(
+            webhook = None,
+            account = self.account,
+            buy_settings = shard.buy_settings,
+            limiteds = helpers.Iterator(data = [items.Generic(item_id = item_id, collectible_item_id = collectible_item_id) for item_id, collectible_item_id in shard.limiteds], settings = shard.priority),
+            proxies = shard.proxies,
+            scheduler = shard.scheduler,
+            priority = shard.priority,
+            batching = shard.batching,
+            proxy_health = shard.proxy_health,
+            store = shard.store
+        )
+        self.watch_limiteds = sniper.WatchLimiteds(settings, self.rolimon_limiteds, ui = False, coordinated = True)
+        self.watch_limiteds.forward_opportunity = self.forward
+
+        self.stopped: Optional[asyncio.Event] = None
+
+    def forward(self, item: items.Data, detected_at: float) -> None:
+        self.outbox.send(("opportunity", self.shard.shard_id, item.item_id, item.product_id, item.collectible_item_id, item.lowest_resale_price, detected_at))
+
+    def receive(self, message: Tuple[Any, ...]) -> None:
+        kind = message[0]
+        if kind == "token":
+            self.account.x_csrf_token.update(message[1])
+        elif kind == "rolimons":
+            self.rolimon_limiteds.publish(message[1], message[2])
+        elif kind == "limiteds":
+            self.watch_limiteds.limiteds.add([items.Generic(item_id = item_id, collectible_item_id = collectible_item_id) for item_id, collectible_item_id in message[1]])
+        elif kind == "stop":
+            self.stopped.set()
+
+    def listen(self, loop: asyncio.AbstractEventLoop) -> None:
+        while True:
+            try:
+                message = self.inbox.recv()
+            except (EOFError, OSError):
+                # coordinator is gone
+                message = ("stop",)
+
+            loop.call_soon_threadsafe(self.receive, message)
+            if message[0] == "stop":
+                return
+
+    async def report(self):
+        ui_manager = self.watch_limiteds.ui_manager
+        requests_sent = items_checked = 0
+
+        while True:
+            await asyncio.sleep(self.shard.stats_interval)
+            self.outbox.send((
+                "stats",
+                self.shard.shard_id,
+                ui_manager.total_requests - requests_sent,
+                ui_manager.total_items_checked - items_checked,
+                self.watch_limiteds.scheduler.rates(),
+                self.watch_limiteds.scheduler.batch_sizes(),
+                metrics.registry.export()
+            ))
+            requests_sent, items_checked = ui_manager.total_requests, ui_manager.total_items_checked
+
+    async def __call__(self):
+        self.stopped = asyncio.Event()
+        threading.Thread(target = self.listen, args = (asyncio.get_running_loop(),), daemon = True).start()
+
+        watching = asyncio.ensure_future(self.watch_limiteds(self.report()))
+        await self.stopped.wait()
+        watching.cancel()
+        try:
+            await watching
+        except asyncio.CancelledError:
+            pass
+
+def worker_main(shard: ShardConfig, inbox: Connection, outbox: Connection) -> None:
+    if shard.uvloop:
+        try:
+            import uvloop
+            uvloop.install()
+        except ImportError:
+            pass
+
+    asyncio.run(ShardWorker(shard, inbox, outbox)())
+
+class Coordinator:
+    # owns the account, csrf token, rolimons data, purchase dedupe and the ui, workers only poll
+    def __init__(self, settings: config.Settings, rolimon_limiteds: helpers.RolimonsDataScraper, ui: bool = True):
+        self.settings = settings
+        self.rolimon_limiteds = rolimon_limiteds
+        self.workers = max(min(settings.shards.workers, len(settings.proxies)), 1)
+
+        self.watch_limiteds = sniper.WatchLimiteds(dataclasses.replace(settings, proxies = []), rolimon_limiteds, ui = ui)
+        self.watch_limiteds.ui_manager.total_proxies = len(settings.proxies)
+        # the ui asks its scheduler for rates, the coordinator answers with the workers numbers
+        self.watch_limiteds.ui_manager.scheduler = self
+        # proxy health lives in the workers, it reaches the coordinator through their metrics
+        self.watch_limiteds.ui_manager.proxy_pool = None
+        self.handler = sniper.ProxyThread(self.watch_limiteds, None)
+        # discovery runs here, what it finds is dealt out to the workers
+        self.watch_limiteds.discovery.feed = self.distribute
+        self.distributed = len(settings.limiteds.original_data)
+
+        self.processes: List[multiprocessing.Process] = []
+        # one queue and sender thread per worker pipe, a big message is written in several parts that must not interleave with another send
+        self.inboxes: List[queue.Queue] = []
+        self.outboxes: List[Connection] = []
+        self.shard_rates: Dict[int, Dict[Optional[str], float]] = {}
+        self.shard_batch_sizes: Dict[int, Dict[str, float]] = {}
+        self.tasks = set()
+
+    def rates(self) -> Dict[Optional[str], float]:
+        rates = {}
+        for shard_rates in self.shard_rates.values():
+            rates.update(shard_rates)
+        return rates
+
+    def batch_sizes(self) -> Dict[str, float]:
+        sizes: Dict[str, List[float]] = {}
+        for shard_sizes in self.shard_batch_sizes.values():
+            for endpoint, size in shard_sizes.items():
+                sizes.setdefault(endpoint, []).append(size)
+        return {endpoint: sum(endpoint_sizes) / len(endpoint_sizes) for endpoint, endpoint_sizes in sizes.items()}
+
+    def shards(self) -> List[ShardConfig]:
+        account = self.settings.account
+        limiteds = [(item.item_id, item.collectible_item_id) for item in self.settings.limiteds.original_data]
+
+        return [
+            ShardConfig(
+                shard_id = shard_id,
+                cookie = account.cookie,
+                user_id = account.user_id,
+                x_csrf_token = account.x_csrf_token.x_crsf_token,
+                limiteds = limiteds[shard_id::self.workers],
+                proxies = self.settings.proxies[shard_id::self.workers],
+                buy_settings = self.settings.buy_settings,
+                scheduler = self.settings.scheduler,
+                priority = self.settings.priority,
+                batching = self.settings.batching,
+                proxy_health = self.settings.proxy_health,
+                rolimons = self.rolimon_limiteds.snapshot,
+                rolimons_time = self.rolimon_limiteds.last_call_time,
+                store = self.settings.store,
+                uvloop = self.settings.shards.uvloop,
+                stats_interval = self.settings.shards.stats_interval,
+                overrides = dict(request.session_pool.overrides)
+            )
+            for shard_id in range(self.workers)
+        ]
+
+    def start(self, loop: asyncio.AbstractEventLoop) -> None:
+        # spawn so it behaves the same on windows, linux and mac
+        context = multiprocessing.get_context("spawn")
+
+        for shard in self.shards():
+            inbox_reader, inbox_writer = context.Pipe(duplex = False)
+            outbox_reader, outbox_writer = context.Pipe(duplex = False)
+
+            process = context.Process(target = worker_main, args = (shard, inbox_reader, outbox_writer), daemon = True)
+            process.start()
+
+            inbox = queue.Queue()
+            self.processes.append(process)
+            self.inboxes.append(inbox)
+            self.outboxes.append(outbox_reader)
+            threading.Thread(target = self.deliver, args = (inbox, inbox_writer), daemon = True).start()
+            threading.Thread(target = self.listen, args = (outbox_reader, loop), daemon = True).start()
+
+    def deliver(self, inbox: queue.Queue, connection: Connection) -> None:
+        # the only thread writing to this pipe
+        while True:
+            message = inbox.get()
+            try:
+                connection.send(message)
+            except (BrokenPipeError, OSError):
+                pass
+            if message[0] == "stop":
+                return
+
+    def listen(self, outbox: Connection, loop: asyncio.AbstractEventLoop) -> None:
+        while True:
+            try:
+                message = outbox.recv()
+            except (EOFError, OSError):
+                return
+            loop.call_soon_threadsafe(self.receive, message)
+
+    def receive(self, message: Tuple[Any, ...]) -> None:
+        kind = message[0]
+        if kind == "opportunity":
+            _, _, item_id, product_id, collectible_item_id, lowest_resale_price, detected_at = message
+            item = items.Data(item_id, product_id, collectible_item_id, lowest_resale_price)
+
+            task = asyncio.ensure_future(self.handler.handle_opportunity(item, detected_at))
+            self.tasks.add(task)
+            task.add_done_callback(self.finished)
+
+        elif kind == "stats":
+            _, shard_id, requests_sent, items_checked, rates, batch_sizes, exported = message
+            self.watch_limiteds.ui_manager.add_requests(requests_sent)
+            self.watch_limiteds.ui_manager.add_items(items_checked)
+            self.shard_rates[shard_id] = rates
+            self.shard_batch_sizes[shard_id] = batch_sizes
+            metrics.registry.absorb(shard_id, exported)
+
+    def finished(self, task: asyncio.Task) -> None:
+        self.tasks.discard(task)
+        if not task.cancelled() and task.exception():
+            self.watch_limiteds.ui_manager.log_event(f"Error handling opportunity: {task.exception()!r}")
+
+    def distribute(self, limiteds: List[items.Generic]) -> int:
+        # continues the round robin shards() started with
+        if not self.inboxes:
+            return 0
+        dealt: List[List[Tuple[int, str]]] = [[] for _ in self.inboxes]
+        for item in limiteds:
+            dealt[self.distributed % len(self.inboxes)].append((item.item_id, item.collectible_item_id))
+            self.distributed += 1
+
+        for inbox, shard_limiteds in zip(self.inboxes, dealt):
+            if shard_limiteds:
+                inbox.put(("limiteds", shard_limiteds))
+        return len(limiteds)
+
+    def broadcast_nowait(self, message: Tuple[Any, ...]) -> None:
+        for inbox in self.inboxes:
+            inbox.put(message)
+
+    async def broadcast(self):
+        x_csrf_token = self.settings.account.x_csrf_token.x_crsf_token
+        snapshot = self.rolimon_limiteds.snapshot
+
+        while True:
+            await asyncio.sleep(0.5)
+
+            if self.settings.account.x_csrf_token.x_crsf_token != x_csrf_token:
+                x_csrf_token = self.settings.account.x_csrf_token.x_crsf_token
+                self.broadcast_nowait(("token", x_csrf_token))
+
+            if self.rolimon_limiteds.snapshot is not snapshot:
+                snapshot = self.rolimon_limiteds.snapshot
+                # the snapshot is big enough to fill the pipe buffer, the sender threads keep it off the loop
+                self.broadcast_nowait(("rolimons", snapshot, self.rolimon_limiteds.last_call_time))
+
+    async def __call__(self):
+        self.start(asyncio.get_running_loop())
+        try:
+            await self.watch_limiteds(self.broadcast())
+        finally:
+            self.broadcast_nowait(("stop",))
+            for process in self.processes:
+                process.join(timeout = 5)
+                if process.is_alive():
+                    process.terminate()
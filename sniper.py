@@ -1,43 +1,101 @@
 from models import items, config, request
-from typing import Union, Tuple, Optional, List, Dict
+from typing import Union, Tuple, Optional, List, Dict, Callable, Awaitable
 
+import time
+import store
 import errors
 import helpers
 import asyncio
+import prices
+import metrics
+import accounts
+import watcher
+import discovery
+import scheduler
+import thresholds
+import notifications
+
+from collections import deque
 
 class BuyLimited:
-    def __init__(self, user_data: config.Account, buy_data: items.BuyData) -> None:
+    # long lived buy engine, keeps the apis.roblox.com connection warm between snipes
+    def __init__(self, user_data: config.Account, warm_interval: float = 20, latencies: Optional[deque] = None) -> None:
         self.user_data = user_data
-        self.buy_data = buy_data
-
+        self.warm_interval = warm_interval
+        
+        self.templates: Dict[str, Tuple[str, dict]] = {}
+        self.latencies: deque = deque(maxlen = 500) if latencies is None else latencies
+    
+    def template(self, buy_data: items.BuyData) -> Tuple[str, dict]:
+        if buy_data.collectible_item_id not in self.templates:
+            route = request.Routes.PURCHASE_RESALE
+            self.templates[buy_data.collectible_item_id] = (
+                route.url(collectible_item_id = buy_data.collectible_item_id),
+                route.encode(buy_data)
+            )
+        return self.templates[buy_data.collectible_item_id]
+    
+    def payload(self, buy_data: items.BuyData) -> Tuple[str, dict]:
+        url, template = self.template(buy_data)
+        
+        payload = template.copy()
+        payload["collectibleItemInstanceId"] = buy_data.collectible_item_instance_id
+        payload["collectibleProductId"] = buy_data.collectible_product_id
+        payload["expectedPrice"] = buy_data.expected_price
+        payload["idempotencyKey"] = buy_data.idempotency_key
+        return url, payload
+    
+    async def warm(self):
+        while True:
+            try:
+                # any answer keeps the pooled keep-alive connection open
+                await request.Request(
+                    url = "https://apis.roblox.com/",
+                    method = "head",
+                    success_status_codes = [200, 301, 302, 403, 404],
+                    timeout = 5
+                ).send()
+            except errors.Request.Failed:
+                pass
+            
+            await asyncio.sleep(self.warm_interval)
      
-    async def __call__(self) -> Union[bool, Tuple[bool, request.ResponseJsons.BuyResponse]]:
+    async def __call__(self, buy_data: items.BuyData, detected_at: Optional[float] = None) -> Union[bool, Tuple[bool, request.ResponseJsons.BuyResponse]]:
+        started = time.perf_counter()
         try:
-            url = f"https://apis.roblox.com/marketplace-sales/v1/item/{self.buy_data.collectible_item_id}/purchase-resale"
+            url, payload = self.payload(buy_data)
             response: request.Response
             response = await request.Request(
                 url = url,
                 method = "post",
+                route = request.Routes.PURCHASE_RESALE,
                 headers = request.Headers(
                     x_csrf_token = await self.user_data.x_csrf_token(),
                     cookies = {".ROBLOSECURITY": self.user_data.cookie}
                 ),
-                json_data = request.RequestJsons.jsonify_api_broad(url, self.buy_data),
+                x_csrf_token = self.user_data.x_csrf_token,
+                json_data = payload,
                 otp_token = self.user_data.otp_token,
-                close_session = False,
                 user_id = self.user_data.user_id
             ).send()
             
+            metrics.registry.increment("purchases_total", result = "purchased" if response.response_json.purchased else "rejected")
             if response.response_json.purchased:
                 return True, response.response_json
             else:
                 return False, response.response_json
             
         except errors.Request.Failed:
+            metrics.registry.increment("purchases_total", result = "failed")
             return False
+        finally:
+            metrics.registry.observe("stage_seconds", time.perf_counter() - started, stage = "purchase")
+            if detected_at:
+                self.latencies.append(time.perf_counter() - detected_at)
+                metrics.registry.observe("detect_to_purchase_seconds", self.latencies[-1])
 
 class WatchLimiteds:
-    def __init__(self, config: config.Settings, rolimon_limiteds: helpers.RolimonsDataScraper) -> None:
+    def __init__(self, config: config.Settings, rolimon_limiteds: helpers.RolimonsDataScraper, ui: bool = True, coordinated: bool = False, config_path: Optional[str] = None) -> None:
         self.webhook = config.webhook
         
         self.account = config.account
@@ -46,17 +104,108 @@ class WatchLimiteds:
         self.custom_settings = config.buy_settings.custom_settings
         self.limiteds = config.limiteds
         self.rolimon_limiteds = rolimon_limiteds
+        self.thresholds = thresholds.BuyThresholds(self.generic_settings, self.custom_settings, rolimon_limiteds)
+        self.prices = prices.PriceStream(self.thresholds, self.limiteds.original_data, recheck_interval = 10)
         self.proxies = config.proxies
-        self.ui_manager = helpers.UIManager(total_proxies = len(config.proxies))
+        self.buy_limited = BuyLimited(self.account)
+        # one buyer per account, they share the latency samples
+        self.accounts = accounts.AccountPool(config.accounts)
+        self.buyers = {id(account): BuyLimited(account, latencies = self.buy_limited.latencies) for account in config.accounts[1:]}
+        self.buyers[id(self.account)] = self.buy_limited
+        self.resale_lookups = helpers.SingleFlight()
+        self.purchases = helpers.SingleFlight(cooldown = self.prices.recheck_interval)
+        self.scheduler_settings = config.scheduler
+        self.batch_settings = config.batching
+        self.scheduler = scheduler.RequestScheduler(config.scheduler, config.batching)
+        self.proxy_pool = scheduler.ProxyPool(config.proxy_health, config.proxies)
+        self.resale_hedger = scheduler.Hedger(config.hedging.get(request.Routes.RESELLERS.name), request.Routes.RESELLERS.name)
+        self.ui_settings = config.ui
+        self.ui_manager = helpers.UIManager(total_proxies = len(config.proxies), scheduler = self.scheduler, headless = config.ui.headless, proxy_pool = self.proxy_pool)
+        self.notifier = notifications.Notifier(config.webhook, self.ui_manager)
         self.requests = 0
+        self.ui = ui
+        self.metrics_settings = config.metrics
+        self.store = store.ObservationStore(config.store)
+        self.discovery = discovery.Discovery(config.discovery, config.unresolved_limiteds, self)
+        
+        # shard workers hand candidates to the coordinator instead of buying, the coordinator owns token, rolimons and purchases
+        self.coordinated = coordinated
+        self.forward_opportunity: Optional[Callable[[items.Data, float], None]] = None
+        
+        # config.json is watched when a path is given, proxies and account token loops are tasks so a reload can start and retire them
+        self.config_path = config_path
+        self.proxy_tasks: List[Tuple[Optional[str], asyncio.Task]] = []
+        self.account_tasks: Dict[int, asyncio.Task] = {}
+        self.failed: Optional[asyncio.Future] = None
+    
+    def start_proxy(self, proxy: Optional[str]) -> None:
+        task = asyncio.ensure_future(ProxyThread(self, proxy).watch()) # self is the own obj for shared vars
+        task.add_done_callback(self.task_stopped)
+        self.proxy_tasks.append((proxy, task))
+    
+    def retire_proxy(self, proxy: Optional[str]) -> None:
+        for index in range(len(self.proxy_tasks) - 1, -1, -1):
+            if self.proxy_tasks[index][0] == proxy:
+                self.proxy_tasks.pop(index)[1].cancel()
+                return
+    
+    def start_account(self, account: config.Account) -> None:
+        if id(account) not in self.buyers:
+            self.buyers[id(account)] = BuyLimited(account, latencies = self.buy_limited.latencies)
+        if not self.coordinated and id(account) not in self.account_tasks:
+            task = asyncio.ensure_future(account.x_csrf_token.run())
+            task.add_done_callback(self.task_stopped)
+            self.account_tasks[id(account)] = task
+    
+    def retire_account(self, account: config.Account) -> None:
+        self.buyers.pop(id(account), None)
+        task = self.account_tasks.pop(id(account), None)
+        if task:
+            task.cancel()
+    
+    def task_stopped(self, task: asyncio.Task) -> None:
+        # these loops only end by failing, that stops the sniper like it did when they were gathered directly
+        if task.cancelled() or self.failed is None or self.failed.done():
+            return
+        if task.exception():
+            self.failed.set_exception(task.exception())
 
-    async def __call__(self):
-        threads = [
-            ProxyThread(self, proxy).watch() # self is the own obj for shared vars
-            for proxy in self.proxies
-        ]
+    async def __call__(self, *tasks: Awaitable):
+        self.failed = asyncio.get_running_loop().create_future()
+        for proxy in self.proxies:
+            self.start_proxy(proxy)
+        
+        restored = await self.store.restore(self.limiteds, self.prices)
+        if restored:
+            self.ui_manager.log_event(f"Restored price history for {restored} items")
+        
+        background = list(tasks) + [self.store.run()]
+        if not self.coordinated:
+            background += [self.rolimon_limiteds.run(), self.buy_limited.warm(), self.notifier.run(), self.discovery.run()]
+            for state in self.accounts.states:
+                self.start_account(state.account)
+        if self.config_path:
+            background.append(watcher.ConfigWatcher(self, self.config_path).run())
+        if self.ui:
+            background.append(helpers.run_ui(ui_manager = self.ui_manager, settings = self.ui_settings))
+        
+        # achieved rate per proxy, computed on every scrape and every shard stats report
+        metrics.registry.collectors.append(self.scheduler.export_rates)
+        metrics_server = None
+        if self.metrics_settings.port:
+            metrics_server = await metrics.registry.serve(self.metrics_settings.host, self.metrics_settings.port)
         
-        await asyncio.gather(*threads, helpers.run_ui(ui_manager = self.ui_manager))
+        try:
+            await asyncio.gather(self.failed, *background)
+        finally:
+            for _, task in self.proxy_tasks:
+                task.cancel()
+            for task in self.account_tasks.values():
+                task.cancel()
+            metrics.registry.collectors.remove(self.scheduler.export_rates)
+            if metrics_server:
+                await metrics_server.cleanup()
+            await request.session_pool.close()
         
 class ProxyThread(helpers.CombinedAttribute):
     webhook: str
@@ -65,7 +214,21 @@ class ProxyThread(helpers.CombinedAttribute):
     custom_settings: Union[None, Dict[str, config.ItemSettings]]
     limiteds: helpers.Iterator
     rolimon_limiteds: helpers.RolimonsDataScraper
+    thresholds: thresholds.BuyThresholds
+    prices: prices.PriceStream
+    store: store.ObservationStore
+    buy_limited: BuyLimited
+    accounts: accounts.AccountPool
+    buyers: Dict[int, BuyLimited]
+    resale_lookups: helpers.SingleFlight
+    purchases: helpers.SingleFlight
     ui_manager: helpers.UIManager
+    notifier: notifications.Notifier
+    scheduler_settings: config.SchedulerSettings
+    scheduler: scheduler.RequestScheduler
+    proxy_pool: scheduler.ProxyPool
+    batch_settings: config.BatchSettings
+    resale_hedger: scheduler.Hedger
     requests: int 
     
     def __init__(self, watch_limiteds: WatchLimiteds, proxy: str):
@@ -73,98 +236,179 @@ class ProxyThread(helpers.CombinedAttribute):
         
         self._proxy = proxy
     
-    def check_if_item_elligable(self, item_data: items.Data, item_value_rap: items.RolimonsData) -> bool:
-        # checking if custom config is avaible. Using custom config if avaible else generic
-        item_buy_config: config.ItemSettings
-        item_buy_config = self.generic_settings if not str(item_data.item_id) in self.custom_settings else self.custom_settings[str(item_data.item_id)]
-        if item_buy_config.price_measurer == "value":
-            if item_value_rap.value:
-                base_value_item = item_value_rap.value
-            else:
-                return False
-        elif item_buy_config.price_measurer == "rap":
-            base_value_item = item_value_rap.rap
-        elif item_buy_config.price_measurer == "value_rap":
-            # use value if avaible else rap
-            base_value_item = item_value_rap.value if item_value_rap.value else item_value_rap.rap
-            
-        if item_buy_config.min_percentage_off and not (base_value_item * (item_buy_config.min_percentage_off / 100)) > item_data.lowest_resale_price:
-            return False
-        if item_buy_config.min_robux_off and not base_value_item - item_data.lowest_resale_price > item_buy_config.min_robux_off:
-            return False
-        if item_buy_config.max_robux_cost and not item_data.lowest_resale_price >= item_buy_config.max_robux_cost:
-            return False
+    async def get_resale_data(self, item: items.Data) -> Union[request.ResponseJsons.ResaleResponse, errors.Request.Failed]:
+        async def attempt(proxy: Optional[str]) -> request.ResponseJsons.ResaleResponse:
+            response = await request.Request(
+                url = request.Routes.RESELLERS.url(collectible_item_id = item.collectible_item_id),
+                method = "get",
+                route = request.Routes.RESELLERS,
+                proxy = proxy,
+                timeout = self.scheduler_settings.timeout
+            ).send()
+            return response.response_json
+        
+        # direct first like before, a hedge or retry goes through the healthiest proxy
+        routes = [None] + [proxy for proxy in self.proxy_pool.ranked() if proxy is not None][:self.resale_hedger.settings.attempts - 1]
+        with metrics.registry.timer("stage_seconds", stage = "resale_data"):
+            return await self.resale_hedger(attempt, routes)
+        
+    async def handle_response(self, item_list: request.ResponseJsons.ItemDetails):
+        detected_at = time.perf_counter()
+        changed, candidates = self.prices.diff(item_list.items)
         
-        return True
+        snapshot = self.rolimon_limiteds.snapshot
+        for item in changed:
+            rolimons_limited = snapshot.get(str(item.item_id))
+            self.limiteds.observe(item.item_id, item.lowest_resale_price, self.thresholds.max_price(item.item_id), rolimons_limited.value if rolimons_limited else 0)
+            self.store.observe(item.item_id, item.lowest_resale_price, self.limiteds.signals[item.item_id].volatility)
+        
+        opportunities = self.thresholds.screen(candidates)
+        if self.forward_opportunity:
+            for item in opportunities:
+                self.forward_opportunity(item, detected_at)
+            return
+        
+        # every deal in the batch starts at once, a second deal does not wait on the first ones buy and can go to another account
+        await asyncio.gather(*[self.try_opportunity(item, detected_at) for item in opportunities])
+    
+    async def try_opportunity(self, item: items.Data, detected_at: float):
+        try:
+            await self.handle_opportunity(item, detected_at)
+        except Exception as reason:
+            # one failed lookup or buy must not cost the rest of the batch
+            self.prices.retry(item.item_id)
+            self.ui_manager.log_event(f"Error handling opportunity {item.item_id}: {reason!r}")
+    
+    async def handle_opportunity(self, item: items.Data, detected_at: float):
+        resale_data: request.ResponseJsons.ResaleResponse
+        resale_data, _ = await self.resale_lookups(item.collectible_item_id, lambda: self.get_resale_data(item))
+        if resale_data is None:
+            # empty resellers list, the listing sold before we got to it
+            return
+        item.lowest_resale_price = resale_data.price
+        if not self.thresholds.is_eligible(item): # check again just incase price has changed
+            return
+        
+        purchase_key = (item.collectible_item_id, resale_data.collectible_item_instance_id)
+        if self.purchases.cooling_down(purchase_key):
+            return
+        
+        buy_response, leader = await self.purchases(purchase_key, lambda: self.buy(item, resale_data, detected_at))
+        if not leader or buy_response is None:
+            return
+        
+        buy_data, buy_response = buy_response
+        self.store.record_purchase(buy_data, item.item_id, bool(buy_response and buy_response[0]), time.perf_counter() - detected_at)
+        self.notifier.notify(f"{'✅' if buy_response and buy_response[0] else '❌'} Bought Item {item.item_id} for {buy_data.expected_price} R$ | ProductID: {buy_data.collectible_product_id} | InstanceID: {buy_data.collectible_item_instance_id} | Buyer: {buy_data.expected_purchaser_id} | {(time.perf_counter() - detected_at) * 1000:.0f}ms")
+        self.ui_manager.add_items_bought()
     
-    @staticmethod
-    async def get_resale_data(item: items.Data) -> Union[request.ResponseJsons.ResaleResponse, errors.Request.Failed]:
-        response = await request.Request(
-            url = f"https://apis.roblox.com/marketplace-sales/v1/item/{item.collectible_item_id}/resellers?limit=1",
-            method = "get",
-            retries = 5
-        ).send()
+    async def buy(self, item: items.Data, resale_data: request.ResponseJsons.ResaleResponse, detected_at: float) -> Optional[Tuple[items.BuyData, Union[bool, Tuple[bool, request.ResponseJsons.BuyResponse]]]]:
+        state = await self.accounts.acquire(resale_data.price)
+        if state is None:
+            self.notifier.notify(f"⏭️ Skipped Item {item.item_id} for {resale_data.price} R$ | no account with budget available", webhook = False)
+            metrics.registry.increment("purchases_total", result = "no_account")
+            return None
+        
+        buy_data = items.BuyData(
+            collectible_item_id = item.collectible_item_id,
+            collectible_item_instance_id = resale_data.collectible_item_instance_id,
+            collectible_product_id = resale_data.collectible_product_id,
+            expected_price = resale_data.price,
+            expected_purchaser_id = str(state.account.user_id)
+        )
+        
+        buy_response = False
+        try:
+            buy_response = await self.buyers[id(state.account)](buy_data, detected_at)
+        finally:
+            self.accounts.release(state, buy_data.expected_price, bool(buy_response and buy_response[0]))
+        return buy_data, buy_response
+
+    async def get_batch_item_data(self, route: request.Route, items: List[items.Generic], proxy = str) -> Union[request.ResponseJsons.ItemDetails, errors.Request.Failed]:
+        with metrics.registry.timer("stage_seconds", stage = "batch_item_data", endpoint = route.name, proxy = metrics.proxy_label(proxy)):
+            response = await request.Request(
+                url = route.template,
+                method = "post",
+                route = route,
+                
+                headers = request.Headers(
+                    cookies = {".ROBLOSECURITY": self.account.cookie},
+                    x_csrf_token = await self.account.x_csrf_token()
+                ),
+                x_csrf_token = self.account.x_csrf_token,
+                json_data = route.encode(items),
+                proxy = proxy,
+                timeout = self.scheduler_settings.timeout
+            ).send()
+        self.ui_manager.add_requests(1)
+        self.ui_manager.add_items(len(items))
         return response.response_json
+
+    def record_health(self, latency: float, reason: Optional[errors.Request.Failed] = None) -> None:
+        cooldown = self.proxy_pool.record(self._proxy, latency, reason)
+        if cooldown:
+            self.ui_manager.log_event(f"Proxy {metrics.proxy_label(self._proxy)} quarantined for {cooldown:.0f}s | {self.proxy_pool.summary()}")
+    
+    async def poll(self, route: request.Route, sizer: scheduler.BatchSizer, bucket: scheduler.AdaptiveRate) -> None:
+        batch_size = sizer.size
+        batch = self.limiteds(batch_size)
+        if not batch:
+            # discovery has not found anything to watch yet
+            return
         
-    async def handle_response(self, item_list: request.ResponseJsons.ItemDetails):
-        rolimons_limited = self.rolimon_limiteds
-        for item in item_list.items:
-            if str(item.item_id) in await rolimons_limited():
-                if self.check_if_item_elligable(item, (await rolimons_limited())[str(item.item_id)]):
-                    resale_data: request.ResponseJsons.ResaleResponse
-                    resale_data = await self.get_resale_data(item)
-                    item.lowest_resale_price = resale_data.price
-                    if self.check_if_item_elligable(item, (await rolimons_limited())[str(item.item_id)]): # check again just incase price has changed
-                        buy_data = items.BuyData(
-                            collectible_item_id = item.collectible_item_id,
-                            collectible_item_instance_id = resale_data.collectible_item_instance_id,
-                            collectible_product_id = resale_data.collectible_product_id,
-                            expected_price = resale_data.price,
-                            expected_purchaser_id = str(self.account.user_id)
-                        )
-                        
-                        buy_response = await BuyLimited(self.account, buy_data)()
-                        
-                        webhook = request.RequestJsons.WebhookMessage(
-                            content = f"{'✅' if buy_response and buy_response[0] else '❌'} Bought Item {item.item_id} for {buy_data.expected_price} R$ | ProductID: {buy_data.collectible_product_id} | InstanceID: {buy_data.collectible_item_instance_id} | Buyer: {buy_data.expected_purchaser_id}"
-                        )
-                        await self.ui_manager.log_event(webhook.content)
-                        await self.ui_manager.add_items_bought()
-                        
-                        await request.Request(
-                            url = self.webhook,
-                            method = "post",
-                            json_data = request.RequestJsons.jsonify_api_broad(self.webhook, webhook),
-                            success_status_codes = [204]
-                        ).send()
-                        
-    async def get_batch_item_data(self, url: str, items: List[items.Generic], proxy = str) -> Union[None, errors.Request.Failed]:
-        response = await request.Request(
-            url = url,
-            method = "post",
-            
-            headers = request.Headers(
-                cookies = {".ROBLOSECURITY": self.account.cookie},
-                x_csrf_token = await self.account.x_csrf_token()
-            ),
-            json_data = request.RequestJsons.jsonify_api_broad(url, items),
-            proxy = proxy
-        ).send()
-        await self.ui_manager.add_requests(1)
-        await self.ui_manager.add_items(len(items))
-        await self.handle_response(response.response_json)
+        started = time.perf_counter()
+        try:
+            item_list = await self.get_batch_item_data(route = route, items = batch, proxy = self._proxy)
+        except errors.Request.Failed as reason:
+            if self.scheduler.is_throttled(reason):
+                bucket.throttled()
+            self.record_health(time.perf_counter() - started, reason)
+            sizer.record(batch_size, time.perf_counter() - started, reason)
+            return
+        
+        bucket.success()
+        self.record_health(time.perf_counter() - started)
+        sizer.record(batch_size, time.perf_counter() - started)
+        if sizer.size != batch_size:
+            metrics.registry.set("batch_size", sizer.size, endpoint = route.name, proxy = metrics.proxy_label(self._proxy))
+        try:
+            await self.handle_response(item_list)
+        except Exception as reason:
+            self.ui_manager.log_event(f"Error handling {route.name} response: {reason!r}")
 
-    async def watch(self):
-        while True:
+    async def watch_endpoint(self, route: request.Route, max_batch_size: int):
+        bucket = self.scheduler.bucket(self._proxy, route.name)
+        sizer = self.scheduler.sizer(self._proxy, route.name, max_batch_size)
+        metrics.registry.set("batch_size", sizer.size, endpoint = route.name, proxy = metrics.proxy_label(self._proxy))
+        in_flight = asyncio.Semaphore(self.scheduler_settings.max_in_flight)
+        tasks = set()
+        
+        async def run():
             try:
-                await asyncio.gather(*[
-                    self.get_batch_item_data(url = "https://catalog.roblox.com/v1/catalog/items/details", items = self.limiteds(120), proxy = self._proxy),
-                    self.get_batch_item_data(url = "https://apis.roblox.com/marketplace-items/v1/items/details", items = self.limiteds(30), proxy = self._proxy)
-                ])
-            except:
-                continue
+                await self.poll(route, sizer, bucket)
             finally:
-                await asyncio.sleep(1)
+                in_flight.release()
+        
+        try:
+            while True:
+                # a quarantined proxy stops pulling from the shared iterator, the healthy ones pick up its items
+                await self.proxy_pool.wait_available(self._proxy)
+                await in_flight.acquire()
+                await bucket.acquire()
+                
+                task = asyncio.create_task(run())
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        finally:
+            # a retired proxy leaves nothing in flight
+            for task in list(tasks):
+                task.cancel()
+
+    async def watch(self):
+        await asyncio.gather(
+            self.watch_endpoint(route = request.Routes.CATALOG_DETAILS, max_batch_size = self.batch_settings.catalog_max),
+            self.watch_endpoint(route = request.Routes.MARKETPLACE_DETAILS, max_batch_size = self.batch_settings.marketplace_max)
+        )
     
     
              
@@ -0,0 +1,148 @@
+import time
+import sqlite3
+import prices
+import asyncio
+import helpers
+import metrics
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, List, Tuple
+
+from models import config, items
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS observations (item_id INTEGER NOT NULL, observed_at REAL NOT NULL, price INTEGER NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS observations_item_time ON observations (item_id, observed_at)",
+    "CREATE TABLE IF NOT EXISTS purchases (item_id INTEGER NOT NULL, observed_at REAL NOT NULL, collectible_item_id TEXT, instance_id TEXT, price INTEGER, buyer TEXT, purchased INTEGER, latency REAL)",
+    "CREATE INDEX IF NOT EXISTS purchases_item_time ON purchases (item_id, observed_at)",
+    "CREATE TABLE IF NOT EXISTS item_state (item_id INTEGER PRIMARY KEY, last_price INTEGER, volatility REAL, updated_at REAL)"
+)
+
+class ObservationStore:
+    # price changes and purchase outcomes are buffered on the loop and written in batches by one sqlite thread
+    def __init__(self, settings: config.StoreSettings):
+        self.settings = settings
+        # sqlite connections stay on the thread that made them, so one worker thread owns it
+        self.executor = ThreadPoolExecutor(max_workers = 1, thread_name_prefix = "store")
+        self.connection: Optional[sqlite3.Connection] = None
+
+        self.observations: List[Tuple[int, float, int]] = []
+        self.states: dict = {}
+        self.purchases: List[tuple] = []
+        self.last_prune = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.settings.path)
+
+    def connect(self) -> sqlite3.Connection:
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.settings.path, timeout = 10)
+            self.connection.execute("PRAGMA journal_mode = WAL")
+            self.connection.execute("PRAGMA synchronous = NORMAL")
+            for statement in SCHEMA:
+                self.connection.execute(statement)
+            self.connection.commit()
+        return self.connection
+
+    async def execute(self, call, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, call, *args)
+
+    def observe(self, item_id: int, price: Optional[int], volatility: float) -> None:
+        if not self.enabled:
+            return
+
+        if len(self.observations) >= self.settings.max_pending:
+            # writer is behind, keep the newest
+            dropped = len(self.observations) // 2
+            del self.observations[:dropped]
+            metrics.registry.increment("store_dropped_total", dropped)
+
+        now = time.time()
+        self.observations.append((item_id, now, price or 0))
+        self.states[item_id] = (item_id, price or 0, volatility, now)
+
+    def record_purchase(self, buy_data: items.BuyData, item_id: int, purchased: bool, latency: float) -> None:
+        if not self.enabled:
+            return
+
+        self.purchases.append((item_id, time.time(), buy_data.collectible_item_id, buy_data.collectible_item_instance_id, buy_data.expected_price, buy_data.expected_purchaser_id, int(purchased), latency))
+
+    def write(self, observations: List[tuple], states: List[tuple], purchases: List[tuple]) -> None:
+        connection = self.connect()
+        with connection:
+            connection.executemany("INSERT INTO observations VALUES (?, ?, ?)", observations)
+            connection.executemany("INSERT OR REPLACE INTO item_state VALUES (?, ?, ?, ?)", states)
+            connection.executemany("INSERT INTO purchases VALUES (?, ?, ?, ?, ?, ?, ?, ?)", purchases)
+
+    def prune(self, before: float) -> None:
+        connection = self.connect()
+        with connection:
+            connection.execute("DELETE FROM observations WHERE observed_at < ?", (before,))
+        connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    async def flush(self) -> None:
+        if not (self.observations or self.states or self.purchases):
+            return
+
+        observations, states, purchases = self.observations, list(self.states.values()), self.purchases
+        self.observations, self.states, self.purchases = [], {}, []
+
+        with metrics.registry.timer("stage_seconds", stage = "store_flush"):
+            await self.execute(self.write, observations, states, purchases)
+        metrics.registry.increment("store_rows_total", len(observations) + len(purchases))
+
+    def load_states(self) -> List[Tuple[int, int, float]]:
+        return self.connect().execute("SELECT item_id, last_price, volatility FROM item_state").fetchall()
+
+    async def restore(self, limiteds: helpers.Iterator, price_stream: prices.PriceStream) -> int:
+        if not self.enabled:
+            return 0
+
+        states = await self.execute(self.load_states)
+        for item_id, last_price, volatility in states:
+            limiteds.restore(item_id, last_price, volatility)
+            price_stream.restore(item_id, last_price)
+        return len(states)
+
+    def select_observations(self, item_id: int, start: float, end: float) -> List[Tuple[float, int]]:
+        return self.connect().execute(
+            "SELECT observed_at, price FROM observations WHERE item_id = ? AND observed_at BETWEEN ? AND ? ORDER BY observed_at",
+            (item_id, start, end)
+        ).fetchall()
+
+    async def observations_between(self, item_id: int, start: float, end: Optional[float] = None) -> List[Tuple[float, int]]:
+        await self.flush()
+        return await self.execute(self.select_observations, item_id, start, end or time.time())
+
+    def select_purchases(self, start: float, end: float) -> List[tuple]:
+        return self.connect().execute(
+            "SELECT item_id, observed_at, price, buyer, purchased, latency FROM purchases WHERE observed_at BETWEEN ? AND ? ORDER BY observed_at",
+            (start, end)
+        ).fetchall()
+
+    async def purchases_between(self, start: float, end: Optional[float] = None) -> List[tuple]:
+        await self.flush()
+        return await self.execute(self.select_purchases, start, end or time.time())
+
+    def close_connection(self) -> None:
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    async def run(self):
+        if not self.enabled:
+            return
+
+        try:
+            while True:
+                await asyncio.sleep(self.settings.flush_interval)
+                await self.flush()
+
+                if self.settings.retention_days and time.time() - self.last_prune > 3600:
+                    self.last_prune = time.time()
+                    await self.execute(self.prune, self.last_prune - self.settings.retention_days * 86400)
+        finally:
+            # whatever is still buffered when the sniper stops
+            await self.flush()
+            await self.execute(self.close_connection)
@@ -0,0 +1,103 @@
+import math
+
+from array import array
+from typing import Optional, Dict, List, Union, Tuple
+
+from models import config, items
+
+import helpers
+
+NO_LIMIT = 2 ** 62
+
+class BuyThresholds:
+    # every rolimons item compiled into the range of prices it gets bought at, rebuilt when the snapshot or settings change
+    def __init__(self, generic_settings: config.ItemSettings, custom_settings: Optional[Dict[str, config.ItemSettings]], rolimon_limiteds: helpers.RolimonsDataScraper):
+        self.generic_settings = generic_settings
+        self.custom_settings = custom_settings or {}
+        self.rolimon_limiteds = rolimon_limiteds
+
+        self.compiled_from: Optional[items.RolimonsTable] = None
+        self.slots: Dict[int, int] = {}
+        # slot 0 is the "not tracked" sentinel every price fails
+        self.min_prices = array("q", [0])
+        self.max_prices = array("q", [-1])
+        self.generation = 0
+
+    def update_settings(self, generic_settings: config.ItemSettings, custom_settings: Optional[Dict[str, config.ItemSettings]]) -> None:
+        self.generic_settings = generic_settings
+        self.custom_settings = custom_settings or {}
+        self.compiled_from = None
+
+    @staticmethod
+    def compile_item(item_settings: config.ItemSettings, item_value_rap: items.RolimonsData) -> Tuple[int, int]:
+        value = item_value_rap.value if item_value_rap.value and item_value_rap.value > 0 else None
+        rap = item_value_rap.rap if item_value_rap.rap and item_value_rap.rap > 0 else None
+
+        if item_settings.price_measurer == "value":
+            base_value_item = value
+        elif item_settings.price_measurer == "value_rap":
+            # use value if avaible else rap
+            base_value_item = value or rap
+        else:
+            base_value_item = rap
+
+        if not base_value_item:
+            return 0, -1
+
+        # the same checks the per item comparison made, all of them strict where it was
+        min_price, max_price = 0, NO_LIMIT
+        if item_settings.min_percentage_off:
+            # price < base * min_percentage_off / 100
+            max_price = min(max_price, math.ceil(base_value_item * item_settings.min_percentage_off / 100) - 1)
+        if item_settings.min_robux_off:
+            # base - price > min_robux_off
+            max_price = min(max_price, base_value_item - item_settings.min_robux_off - 1)
+        if item_settings.max_robux_cost:
+            # price >= max_robux_cost, a floor despite the name
+            min_price = item_settings.max_robux_cost
+
+        return min_price, max_price
+
+    def rebuild(self, snapshot: items.RolimonsTable) -> None:
+        slots = {}
+        min_prices = array("q", [0])
+        max_prices = array("q", [-1])
+        custom_settings = {int(item_id): item_settings for item_id, item_settings in self.custom_settings.items()}
+
+        for item_id, rap, value in snapshot.rows():
+            item_settings = custom_settings.get(item_id, self.generic_settings)
+            min_price, max_price = self.compile_item(item_settings, items.RolimonsData(rap = rap, value = value))
+            slots[item_id] = len(max_prices)
+            min_prices.append(min_price)
+            max_prices.append(max_price)
+
+        self.slots, self.min_prices, self.max_prices = slots, min_prices, max_prices
+        self.compiled_from = snapshot
+        self.generation += 1
+
+    def refresh(self) -> None:
+        snapshot = self.rolimon_limiteds.snapshot
+        if snapshot is not self.compiled_from:
+            self.rebuild(snapshot)
+
+    def max_price(self, item_id: Union[int, str]) -> int:
+        self.refresh()
+        return self.max_prices[self.slots.get(int(item_id), 0)]
+
+    def in_range(self, item_id: Union[int, str], price: Optional[int]) -> bool:
+        self.refresh()
+        slot = self.slots.get(int(item_id), 0)
+        return bool(price) and self.min_prices[slot] <= price <= self.max_prices[slot]
+
+    def is_eligible(self, item: items.Data) -> bool:
+        return self.in_range(item.item_id, item.lowest_resale_price)
+
+    def screen(self, batch: List[items.Data]) -> List[items.Data]:
+        self.refresh()
+        slots, min_prices, max_prices = self.slots, self.min_prices, self.max_prices
+
+        # items without resellers come back with a null / 0 price and never pass
+        return [
+            item for item in batch
+            if item.lowest_resale_price and min_prices[slots.get(item.item_id, 0)] <= item.lowest_resale_price <= max_prices[slots.get(item.item_id, 0)]
+        ]
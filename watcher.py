@@ -0,0 +1,140 @@
+import os
+import asyncio
+
+from collections import Counter
+from typing import Optional, List, Dict, Tuple
+
+from models import config, request
+
+class ConfigWatcher:
+    # polls config.json, a changed file is parsed and logged into off the hot path and then swapped in without an await in between
+    def __init__(self, watch_limiteds: 'sniper.WatchLimiteds', path: str = "config.json", interval: float = 2):
+        self.watch_limiteds = watch_limiteds
+        self.path = path
+        self.interval = interval
+
+    def signature(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def load(self) -> config.Settings:
+        return config.parse(config.read(self.path), login = False)
+
+    async def login(self, settings: config.Settings) -> Dict[int, config.Account]:
+        # only a changed cookie logs in again, everything else keeps its live account with token and purchase history
+        current = {state.account.config_cookie: state.account for state in self.watch_limiteds.accounts.states}
+        kept = {}
+        for account in settings.accounts:
+            if account.config_cookie in current:
+                kept[id(account)] = current[account.config_cookie]
+            else:
+                await account.authenticate()
+        return kept
+
+    def apply(self, settings: config.Settings, kept: Dict[int, config.Account]) -> List[str]:
+        watch_limiteds = self.watch_limiteds
+        changes = []
+
+        buy_settings = config.BuySettings(watch_limiteds.generic_settings, watch_limiteds.custom_settings)
+        if settings.buy_settings != buy_settings:
+            watch_limiteds.generic_settings = settings.buy_settings.generic_settings
+            watch_limiteds.custom_settings = settings.buy_settings.custom_settings
+            watch_limiteds.thresholds.update_settings(watch_limiteds.generic_settings, watch_limiteds.custom_settings)
+            changes.append("buy settings")
+
+        # discovered limiteds are not in the file, they stay until a restart
+        added, retired = watch_limiteds.limiteds.update(settings.limiteds.original_data + list(watch_limiteds.discovery.tracked.values()))
+        if added or retired:
+            changes.append(f"limiteds +{added} -{retired}")
+        watch_limiteds.limiteds.settings = settings.priority
+
+        # proxies can be listed more than once, every entry is its own watcher
+        current, incoming = Counter(watch_limiteds.proxies), Counter(settings.proxies)
+        for proxy, count in (incoming - current).items():
+            watch_limiteds.proxy_pool.add(proxy)
+            for _ in range(count):
+                watch_limiteds.start_proxy(proxy)
+        for proxy, count in (current - incoming).items():
+            for _ in range(count):
+                watch_limiteds.retire_proxy(proxy)
+            if proxy not in incoming:
+                watch_limiteds.proxy_pool.remove(proxy)
+                watch_limiteds.scheduler.remove(proxy)
+        if incoming != current:
+            changes.append(f"proxies +{sum((incoming - current).values())} -{sum((current - incoming).values())}")
+        watch_limiteds.proxies = settings.proxies
+        watch_limiteds.ui_manager.total_proxies = len(settings.proxies)
+
+        accounts = []
+        for account in settings.accounts:
+            live = kept.get(id(account))
+            if live:
+                live.otp_token = account.otp_token
+                live.budget = account.budget
+                live.max_purchases_per_minute = account.max_purchases_per_minute
+            accounts.append(live or account)
+
+        previous = [state.account for state in watch_limiteds.accounts.states]
+        for account in previous:
+            if not any(account is live for live in accounts):
+                watch_limiteds.retire_account(account)
+        for account in accounts:
+            watch_limiteds.start_account(account)
+        watch_limiteds.accounts.update(accounts)
+        watch_limiteds.account = accounts[0]
+        if [id(account) for account in accounts] != [id(account) for account in previous]:
+            changes.append(f"accounts {len(previous)} -> {len(accounts)}")
+
+        watch_limiteds.scheduler_settings = settings.scheduler
+        watch_limiteds.batch_settings = settings.batching
+        watch_limiteds.scheduler.update_settings(settings.scheduler, settings.batching, {
+            request.Routes.CATALOG_DETAILS.name: settings.batching.catalog_max,
+            request.Routes.MARKETPLACE_DETAILS.name: settings.batching.marketplace_max
+        })
+        watch_limiteds.proxy_pool.update_settings(settings.proxy_health)
+        watch_limiteds.resale_hedger.settings = settings.hedging.get(request.Routes.RESELLERS.name) or config.HedgeSettings()
+
+        watch_limiteds.webhook = settings.webhook
+        watch_limiteds.notifier.webhook = settings.webhook
+
+        # these are set up once at start
+        for name, before, after in (
+            ("metrics", watch_limiteds.metrics_settings, settings.metrics),
+            ("ui", watch_limiteds.ui_settings, settings.ui),
+            ("store", watch_limiteds.store.settings, settings.store),
+            ("discovery", (watch_limiteds.discovery.settings, watch_limiteds.discovery.unresolved), (settings.discovery, settings.unresolved_limiteds))
+        ):
+            if before != after:
+                changes.append(f"{name} needs a restart")
+
+        return changes
+
+    async def reload(self) -> None:
+        ui_manager = self.watch_limiteds.ui_manager
+        try:
+            settings = await asyncio.get_running_loop().run_in_executor(None, self.load)
+            kept = await self.login(settings)
+        except Exception as reason:
+            # whatever is wrong with the new file, the sniper keeps running on the old one
+            ui_manager.log_event(f"Config reload rejected, keeping the running config: {reason!r}")
+            return
+
+        changes = self.apply(settings, kept)
+        ui_manager.log_event(f"Config reloaded: {', '.join(changes) or 'no changes'}")
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        seen = await loop.run_in_executor(None, self.signature)
+
+        while True:
+            await asyncio.sleep(self.interval)
+            signature = await loop.run_in_executor(None, self.signature)
+            # missing while an editor saves, wait for it to come back
+            if signature is None or signature == seen:
+                continue
+
+            seen = signature
+            await self.reload()